@@ -1,70 +1,122 @@
+import atexit
+import importlib
+import time
+
 from flask import Flask, jsonify
 from flask_jwt_extended import JWTManager
 from flask_cors import CORS
 from flask_pymongo import PyMongo
 from config import Config
-from routes.video_generation import video_gen_bp, init_video_generation
-
-app = Flask(__name__)
-app.config.from_object(Config)
-jwt = JWTManager(app)
-
-db = None
-
-try:
-    mongo = PyMongo(app)
-    db = mongo.db
-    print("Database connected:", db.name)
-except Exception as e:
-    print("Database connection error:", e)
-
-CORS(app,
-     origins=["http://localhost:3000", "http://localhost:3005", "https://flippedclassroom.ngrok-free.app", "https://gxptd94b-3005.asse.devtunnels.ms", "https://gxptd94b-5000.asse.devtunnels.ms"],
-     supports_credentials=True,
-     allow_headers=["Content-Type", "Authorization", "x-tunnel-skip-anti-phishing-page"],
-     methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-     resources={
-         r"/api/*": {"origins": "*"},
-         r"/db/*": {"origins": "*"},
-         r"/auth/*": {"origins": "*"}
-     })
-
-from routes.admin import admin_bp, init_db as init_admin_db
-from routes.auth import auth_bp, init_db as init_auth_db
-from routes.db import db_bp, init_db as init_db_db
-from routes.llm import llm_bp, init_db as init_llm_db
-from routes.ai import ai_bp
-from routes.analytics import analytics_bp, init_analytics  
-
-
-init_admin_db(db)
-init_auth_db(db)
-init_db_db(db)
-init_llm_db(db)
-init_analytics(db) 
-init_video_generation(db, app)
-
-
-app.register_blueprint(ai_bp, url_prefix='/api/ai')
-app.register_blueprint(admin_bp, url_prefix='/admin')
-app.register_blueprint(auth_bp, url_prefix='/auth')
-app.register_blueprint(db_bp, url_prefix='/db')
-app.register_blueprint(llm_bp, url_prefix='/api/llm')
-app.register_blueprint(analytics_bp)  
-app.register_blueprint(video_gen_bp)
-
-@app.route('/')
-def index():
-    return jsonify({
-        "message": "Flipped Classroom API",
-        "status": "running",
-        "database": db.name if db is not None else "Not connected"
-    })
+from utils import background, http_client
+from utils.data_access import init_db as init_data_access
+from utils.student_stats import init_db as init_student_stats
+from utils.token_usage import init_db as init_token_usage
+from utils.indexes import ensure_indexes
+from utils.migrate_schema import is_migrated, has_legacy_documents
+from utils.metrics import MongoCommandListener, init_metrics
+
+
+def create_app(config_object=Config):
+    """
+    Build the Flask app. Called once per process: by `python app.py` in
+    development and by wsgi.py in each gunicorn worker, so every worker
+    opens its own MongoDB client after the fork.
+    """
+    app = Flask(__name__)
+    app.config.from_object(config_object)
+    JWTManager(app)
+
+    mongo = None
+    db = None
+
+    try:
+        mongo = PyMongo(app, event_listeners=[MongoCommandListener()])
+        db = mongo.db
+        print("Database connected:", db.name)
+    except Exception as e:
+        print("Database connection error:", e)
+
+    CORS(app,
+         origins=["http://localhost:3000", "http://localhost:3005", "https://flippedclassroom.ngrok-free.app", "https://gxptd94b-3005.asse.devtunnels.ms", "https://gxptd94b-5000.asse.devtunnels.ms"],
+         supports_credentials=True,
+         allow_headers=["Content-Type", "Authorization", "x-tunnel-skip-anti-phishing-page"],
+         methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+         resources={
+             r"/api/*": {"origins": "*"},
+             r"/db/*": {"origins": "*"},
+             r"/auth/*": {"origins": "*"}
+         })
+
+    init_metrics(app)
+
+    # Heavy pieces (Manim pipeline, HTTP client) load on first use, not here
+    import_times = app.extensions["import_times_ms"] = {}
+    admin = timed_import("routes.admin", import_times)
+    auth = timed_import("routes.auth", import_times)
+    db_routes = timed_import("routes.db", import_times)
+    llm = timed_import("routes.llm", import_times)
+    ai = timed_import("routes.ai", import_times)
+    analytics = timed_import("routes.analytics", import_times)
+    video_generation = timed_import("routes.video_generation", import_times)
+    print("[STARTUP] Blueprint import times (ms):", import_times)
+
+    background.init_background(app)
+    if db is not None:
+        ensure_indexes(db)
+        # The marker check keeps migrated databases from being scanned at every start
+        if not is_migrated(db) and has_legacy_documents(db):
+            print("[MIGRATE] Documents may still use the legacy schema; run: python -m utils.migrate_schema")
+    init_data_access(db)
+    init_student_stats(db)
+    init_token_usage(db, app.config.get("TOKEN_SESSION_TTL_SECONDS", 6 * 3600))
+    admin.init_db(db)
+    auth.init_db(db)
+    db_routes.init_db(db)
+    llm.init_db(db)
+    analytics.init_analytics(db)
+    video_generation.init_video_generation(db, app)
+
+    app.register_blueprint(ai.ai_bp, url_prefix='/api/ai')
+    app.register_blueprint(admin.admin_bp, url_prefix='/admin')
+    app.register_blueprint(auth.auth_bp, url_prefix='/auth')
+    app.register_blueprint(db_routes.db_bp, url_prefix='/db')
+    app.register_blueprint(llm.llm_bp, url_prefix='/api/llm')
+    app.register_blueprint(analytics.analytics_bp)
+    app.register_blueprint(video_generation.video_gen_bp)
+
+    @app.route('/')
+    def index():
+        return jsonify({
+            "message": "Flipped Classroom API",
+            "status": "running",
+            "database": db.name if db is not None else "Not connected"
+        })
+
+    atexit.register(shutdown_app, mongo)
+    return app
+
+
+def timed_import(module_name, import_times):
+    """Import a blueprint module and record how long it took in milliseconds."""
+    start = time.perf_counter()
+    module = importlib.import_module(module_name)
+    import_times[module_name] = round((time.perf_counter() - start) * 1000, 1)
+    return module
+
+
+def shutdown_app(mongo=None):
+    """Let running background tasks finish, then release pooled connections."""
+    print("Shutting down: waiting for background tasks")
+    background.shutdown(wait=True)
+    http_client.close_session()
+    if mongo is not None:
+        mongo.cx.close()
+
 
 if __name__ == '__main__':
+    app = create_app()
     print("=" * 50)
     print("Flipped Classroom Backend Starting...")
-    print(f"Database: {db.name if db is not None else 'Not connected'}")
     print(f"CORS: Enabled for localhost:3000, 3005")
     print("=" * 50)
     app.run(debug=True, use_reloader=False, host='0.0.0.0', port=5000)
@@ -21,6 +21,36 @@ class Config:
     DEEPSEEK_MODEL = os.getenv('DEEPSEEK_MODEL', 'deepseek-chat')
     DEEPSEEK_BASE_URL = os.getenv('DEEPSEEK_BASE_URL', 'https://api.deepseek.com')
     
+    # Background jobs
+    VIDEO_JOB_WORKERS = int(os.getenv('VIDEO_JOB_WORKERS', 2))
+    # A queued/running video job whose server process stopped sending heartbeats this long ago is failed
+    VIDEO_JOB_STALE_SECONDS = int(os.getenv('VIDEO_JOB_STALE_SECONDS', 300))
+    MATERIAL_JOB_WORKERS = int(os.getenv('MATERIAL_JOB_WORKERS', 4))
+    # A material still "generating" with no worker activity for this long is reported as failed
+    MATERIAL_STALE_SECONDS = int(os.getenv('MATERIAL_STALE_SECONDS', 600))
+    # Students processed concurrently by a batch report job
+    REPORT_WORKERS = int(os.getenv('REPORT_WORKERS', 4))
+    # A queued/running report job without progress this long may be resumed
+    REPORT_JOB_STALE_SECONDS = int(os.getenv('REPORT_JOB_STALE_SECONDS', 600))
+    # Manim processes per server process; 0 = this process's share of the CPU cores.
+    # Never more than that share, so all workers together stay within the host's cores.
+    MANIM_RENDER_WORKERS = int(os.getenv('MANIM_RENDER_WORKERS', 0))
+    # Server processes on this host (gunicorn.conf.py sets it; 1 for python app.py)
+    WEB_WORKERS = int(os.getenv('GUNICORN_WORKERS', 1))
+
+    # Caches
+    MANIM_CODE_CACHE_TTL_DAYS = int(os.getenv('MANIM_CODE_CACHE_TTL_DAYS', 30))
+    MANIM_CODE_CACHE_MAX_ENTRIES = int(os.getenv('MANIM_CODE_CACHE_MAX_ENTRIES', 5000))
+    # Rendered slide videos: evicted (with their files) when unused this long or past the size cap
+    MANIM_RENDER_CACHE_TTL_DAYS = int(os.getenv('MANIM_RENDER_CACHE_TTL_DAYS', 30))
+    MANIM_RENDER_CACHE_MAX_ENTRIES = int(os.getenv('MANIM_RENDER_CACHE_MAX_ENTRIES', 2000))
+
+    # Token usage sessions expire this long after their last update, even if never ended
+    TOKEN_SESSION_TTL_SECONDS = int(os.getenv('TOKEN_SESSION_TTL_SECONDS', 6 * 3600))
+
+    # /metrics requires "Authorization: Bearer <METRICS_TOKEN>" when set
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
     # Other configs
     OFFICE_SECRET_KEY = os.getenv('OFFICE_SECRET_KEY')
     PUBLIC_BASE_URL = os.getenv('PUBLIC_BASE_URL')
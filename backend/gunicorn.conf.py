@@ -0,0 +1,56 @@
+import multiprocessing
+import os
+
+# gunicorn settings, overridable through the environment:
+#     gunicorn -c gunicorn.conf.py wsgi:app
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5000")
+
+# Each worker is a separate process with its own MongoDB client, HTTP session
+# and background pools (video jobs, manim renders), so don't oversubscribe:
+# the app splits the CPU cores between workers for manim rendering.
+workers = int(os.getenv("GUNICORN_WORKERS", multiprocessing.cpu_count()))
+# Workers read this (Config.WEB_WORKERS) to size their render pool
+os.environ["GUNICORN_WORKERS"] = str(workers)
+
+# Threads serve slow requests (LLM calls, SSE progress streams) concurrently
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", 8))
+
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 120))
+# Time a worker gets on shutdown/reload to finish requests and background tasks
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", 60))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", 5))
+
+# Off by default: workers also run background jobs (video renders of up to
+# 10 minutes, material generation, report batches), and recycling a worker
+# would cut them short. Only enable with a graceful_timeout longer than a job.
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", 0))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", 200))
+
+# Keep off: the app (and its MongoClient) must be created after the fork
+preload_app = False
+
+accesslog = os.getenv("GUNICORN_ACCESS_LOG", "-")
+errorlog = "-"
+
+# On exit each worker runs app.shutdown_app (registered with atexit):
+# background tasks are allowed to finish, then pooled connections are closed.
+
+
+# /metrics: with PROMETHEUS_MULTIPROC_DIR set, workers write their metrics to
+# files there and /metrics sums them. Start from an empty directory, and drop
+# a worker's live gauges when it exits.
+def on_starting(server):
+    metrics_dir = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if metrics_dir:
+        os.makedirs(metrics_dir, exist_ok=True)
+        for name in os.listdir(metrics_dir):
+            if name.endswith(".db"):
+                os.remove(os.path.join(metrics_dir, name))
+
+
+def child_exit(server, worker):
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -3,6 +3,7 @@ from flask_jwt_extended import jwt_required, get_jwt_identity
 from bson.objectid import ObjectId
 from datetime import datetime
 from flask_bcrypt import Bcrypt
+from utils import token_usage
 
 db = None
 
@@ -15,5 +16,38 @@ admin_bp = Blueprint('admin', __name__)
 def admin_auth():
     current_user_id = get_jwt_identity()
     current_user = db.users.find_one({"_id": ObjectId(current_user_id)})
-    if not current_user or current_user.get('role', '').lower() == "admin":
-        return jsonify({"error": "Admin access is required"})
\ No newline at end of file
+    if not current_user or current_user.get('role', '').lower() != "admin":
+        return jsonify({"error": "Admin access is required"})
+
+def is_admin(user_id) -> bool:
+    """Access tokens carry no role claim, so the role is read from users."""
+    try:
+        user = db.users.find_one({"_id": ObjectId(user_id)}, {"role": 1})
+    except Exception:
+        return False
+    return bool(user) and (user.get("role") or "").lower() == "admin"
+
+@admin_bp.route('/metrics/llm', methods=['GET'])
+@jwt_required()
+def llm_metrics():
+    """
+    Token and latency aggregates of LLM operations, per endpoint, user and model,
+    plus tokens per generated material and per slide video.
+    Query: days (default 7, at most 90).
+    """
+    if db is None or token_usage.operations_collection is None:
+        return jsonify({"error": "Database not connected"}), 503
+
+    if not is_admin(get_jwt_identity()):
+        return jsonify({"error": "Admin access is required"}), 403
+
+    try:
+        days = int(request.args.get("days", 7))
+    except ValueError:
+        return jsonify({"error": "days must be an integer"}), 400
+    days = min(max(days, 1), token_usage.MAX_METRICS_DAYS)
+
+    try:
+        return jsonify(token_usage.llm_metrics(days)), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
@@ -1,12 +1,12 @@
 from flask import Blueprint, request, jsonify, Response
 from flask_jwt_extended import jwt_required, get_jwt_identity
-import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util import Retry
 import re
 import json
+import time
 
 from utils.token_usage import token_tracker, get_token_usage
+from utils.http_client import get_session, get_stream_session
+from utils import data_access
 
 ai_bp = Blueprint('ai', __name__)
 
@@ -36,14 +36,6 @@ DEFENSIVE_REPLY = (
 def is_assignment_question(message: str) -> bool:
     return any(keyword in message.lower() for keyword in BAD_KEYWORDS)
 
-def get_session():
-    session = requests.Session()
-    retry = Retry(total=3, backoff_factor=1.5, status_forcelist=[429, 500, 502, 503, 504])
-    adapter = HTTPAdapter(max_retries=retry)
-    session.mount('http://', adapter)
-    session.mount('https://', adapter)
-    return session
-
 def smart_wrap_latex(text: str) -> str:
     lines = text.split('\n')
     result = []
@@ -105,7 +97,7 @@ def ai_chat():
                 "stream": True
             }
 
-            with requests.post(
+            with get_stream_session().post(
                 "https://api.deepseek.com/chat/completions",
                 json=payload,
                 headers={"Authorization": f"Bearer {DEEPSEEK_API_KEY}", "Content-Type": "application/json"},
@@ -143,7 +135,9 @@ def generate_question():
 
     # Initialize token tracking with detailed error logging
     try:
-        token_tracker.start_session_tracking()
+        token_tracker.start_session_tracking(
+            user_id=get_jwt_identity(), material_id=request.form.get('material_id') or None
+        )
         print("[TOKEN_TRACKER] Session tracking continued for question generation")
     except Exception as te:
         print(f"[TOKEN_TRACKER] ERROR in start_session_tracking: {str(te)}")
@@ -254,7 +248,8 @@ def generate_question():
             "stream": False
         }
 
-        with requests.post(
+        started = time.perf_counter()
+        with get_session().post(
             "https://api.deepseek.com/chat/completions",
             json=payload,
             headers={"Authorization": f"Bearer {DEEPSEEK_API_KEY}", "Content-Type": "application/json"},
@@ -263,11 +258,13 @@ def generate_question():
         ) as resp:
             resp.raise_for_status()
             response = resp.json()
+            latency_ms = (time.perf_counter() - started) * 1000
 
             # Track token usage for question generation
             try:
                 _, token_usage = get_token_usage(response)
-                token_tracker.add_usage(token_usage, "Question Generation", endpoint="/generate-question")
+                token_tracker.add_usage(token_usage, "Question Generation", endpoint="/generate-question",
+                                        latency_ms=latency_ms, model=DEEPSEEK_MODEL)
                 print(f"[TOKEN_TRACKER] Token usage parsed: {token_usage}")
             except Exception as get_err:
                 print(f"[TOKEN_TRACKER] ERROR in get_token_usage: {str(get_err)}")
@@ -285,48 +282,25 @@ def generate_question():
                 print(f"JSON decode error: {str(jde)}")
                 return jsonify({'error': 'Failed to parse generated content as JSON', 'details': str(jde)}), 500
             
-        # Prepare to save question sets into /db/question-add
-        try:
-            base = request.host_url.rstrip('/')
-            auth_hdr = {}
-            auth = request.headers.get("Authorization")
-            if auth:
-                auth_hdr["Authorization"] = auth
-            
-            session = get_session()
-            url = f"{base}/db/question-add"
-
-            print(f"Preparing to post questions via /db/question-add route at {url}")
-            print(f"Topic: {topic}, User ID: {uploaded_by}")
-        except Exception as e:
-            raise Exception(f"Error preparing url: {str(e)}")
-
-        
-        # Make the POST request through /db/question-add
+        # Save question set
         try:
-            # Prepare file object
-            data = {
-                "material_id": str(material_id) if material_id else "",
-                # "topic": topic,
-                "user_id": uploaded_by,
-                "question_content": content_json,
-                "create_type": "generated"
-            }
-
-            resp = session.post(
-                url,
-                json=data,
-                headers=auth_hdr,
-                timeout=30
+            print(f"Saving questions for topic: {topic}, User ID: {uploaded_by}")
+            question_id = data_access.create_question(
+                str(material_id) if material_id else "",
+                content_json,
+                uploaded_by,
+                create_type="generated"
             )
-            resp.raise_for_status()
-            question_result = resp.json()
+            question_result = {
+                "_id": question_id,
+                "message": "Question added successfully"
+            }
 
-            print(f"Material successfully posted via /db/question-add: {question_result}")
+            print(f"Questions successfully saved: {question_result}")
 
             return question_result
         except Exception as e:
-            raise Exception(f"Failed to save questions via /db/question-add route: {str(e)}")
+            raise Exception(f"Failed to save questions: {str(e)}")
 
     except Exception as e:
         error_msg = "DeepSeek 連線失敗"
@@ -404,7 +378,7 @@ Format using markdown with ## headers. Be encouraging but honest. Focus on actio
             "stream": False
         }
         
-        response = requests.post(
+        response = get_session().post(
             "https://api.deepseek.com/chat/completions",
             json=payload,
             headers={
@@ -549,10 +523,11 @@ def generate_performance_report(analytics_data):
         analytics_data: dict containing student statistics and question analysis
     
     Returns:
-        str: Markdown formatted performance report
+        (str, bool): Markdown formatted performance report, and whether it came
+        from the AI (False: template report from generate_fallback_report)
     """
     if not DEEPSEEK_API_KEY:
-        return generate_fallback_report(analytics_data)
+        return generate_fallback_report(analytics_data), False
     
     student_name = analytics_data['student_name']
     total_submissions = analytics_data['total_submissions']
@@ -620,7 +595,7 @@ No encouragement, conclusions, or recommendations. Keep it objective and data-fo
             "stream": False
         }
         
-        response = requests.post(
+        response = get_session().post(
             "https://api.deepseek.com/chat/completions",
             json=payload,
             headers={
@@ -635,11 +610,11 @@ No encouragement, conclusions, or recommendations. Keep it objective and data-fo
         ai_report = result['choices'][0]['message']['content'].strip()
         
         print(f"[ANALYTICS] DeepSeek AI report generated successfully for {student_name}")
-        return ai_report
+        return ai_report, True
         
     except Exception as ai_error:
         print(f"[ANALYTICS] DeepSeek API error: {str(ai_error)}")
-        return generate_fallback_report(analytics_data)
+        return generate_fallback_report(analytics_data), False
 
 
 def generate_fallback_report(analytics_data):
@@ -799,7 +774,7 @@ Return a JSON object with 'is_correct' (boolean) and 'feedback' (string)."""
             "stream": False
         }
 
-        response = requests.post(
+        response = get_session().post(
             f"{DEEPSEEK_BASE_URL}/chat/completions",
             json=payload,
             headers={"Authorization": f"Bearer {DEEPSEEK_API_KEY}", "Content-Type": "application/json"},
@@ -837,13 +812,14 @@ Return a JSON object with 'is_correct' (boolean) and 'feedback' (string)."""
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
-def translate_report_to_chinese(english_report: str) -> str:
+def translate_report_to_chinese(english_report: str) -> tuple[str, bool]:
     """
     Translate an English markdown report into Traditional Chinese (zh-HK).
     Preserves all markdown formatting (##, **, -, etc).
+    Returns (report, translated); on failure the report is an error notice.
     """
     if not DEEPSEEK_API_KEY:
-        return "## 翻譯失敗\n\n未設定 DeepSeek API 金鑰。"
+        return "## 翻譯失敗\n\n未設定 DeepSeek API 金鑰。", False
 
     try:
         headers = {
@@ -872,7 +848,7 @@ def translate_report_to_chinese(english_report: str) -> str:
             "max_tokens": 2000
         }
 
-        response = requests.post(
+        response = get_session().post(
             "https://api.deepseek.com/v1/chat/completions",
             headers=headers,
             json=payload,
@@ -880,8 +856,8 @@ def translate_report_to_chinese(english_report: str) -> str:
         )
         response.raise_for_status()
         result = response.json()
-        return result['choices'][0]['message']['content']
+        return result['choices'][0]['message']['content'], True
 
     except Exception as e:
         print(f"[AI] Translation error: {str(e)}")
-        return f"## 翻譯失敗\n\n無法將報告翻譯成中文。錯誤：{str(e)}"
+        return f"## 翻譯失敗\n\n無法將報告翻譯成中文。錯誤：{str(e)}", False
@@ -1,21 +1,49 @@
 from flask import Blueprint, jsonify, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from bson import ObjectId
-from datetime import datetime
+from datetime import datetime, timedelta
+import hashlib
+import json
+from utils import background
+from utils.data_access import to_object_id
 
 analytics_bp = Blueprint('analytics', __name__)
 
 db = None
 
+REPORT_JOB_POOL = "report_jobs"
+REPORT_STUDENT_POOL = "report_students"
+# Each process refreshes heartbeat_at of the report jobs it owns; a queued/running
+# job without a heartbeat for report_job_stale_seconds is considered orphaned
+# (its server process died): reported as failed, and may be resumed
+REPORT_JOB_HEARTBEAT_SECONDS = 30
+report_job_stale_seconds = 600
+
 def init_analytics(database):
     """Initialize the analytics blueprint with database connection"""
     global db
     db = database
-    # Auto-create index on ai_reports for fast student lookup
-    db.ai_reports.create_index([("student_id", 1)], unique=True)
+    if db is not None:
+        background.start_heartbeat("report-job-heartbeat", beat_report_jobs, REPORT_JOB_HEARTBEAT_SECONDS)
     print("[ANALYTICS] Analytics module initialized")
 
 
+def beat_report_jobs():
+    db.report_jobs.update_many(
+        {"worker": background.worker_id(), "status": {"$in": ["queued", "running"]}},
+        {"$set": {"heartbeat_at": datetime.utcnow()}}
+    )
+
+
+@analytics_bp.record_once
+def on_load(state):
+    # One coordinator per batch; students of a batch fan out to a bounded pool
+    background.register_pool(REPORT_JOB_POOL, 1)
+    background.register_pool(REPORT_STUDENT_POOL, state.app.config.get("REPORT_WORKERS", 4))
+    global report_job_stale_seconds
+    report_job_stale_seconds = state.app.config.get("REPORT_JOB_STALE_SECONDS", 600)
+
+
 @analytics_bp.route('/api/analytics/students', methods=['GET'])
 @jwt_required()
 def get_student_analytics():
@@ -24,110 +52,37 @@ def get_student_analytics():
         if total_materials_count == 0:
             total_materials_count = 1
 
-        pipeline = [
-            {"$match": {"status": "submitted"}},
-
-            # ✅ 加 lookup 排除已刪除 material 的 submission
-            {
-                "$lookup": {
-                    "from": "materials",
-                    "localField": "material_id",
-                    "foreignField": "_id",
-                    "as": "material_info"
-                }
-            },
-            # ✅ 過濾：只保留 material 未刪除的 submissions
-            {
-                "$match": {
-                    "material_info": {"$ne": []},                    # material 存在
-                    "material_info.0.is_deleted": {"$ne": True}      # 且未刪除
-                }
-            },
-
-            {
-                "$group": {
-                    "_id": "$student_id",
-                    "total_submissions": {"$sum": 1},
-                    "avg_score": {"$avg": "$total_score"},           # ← 現在只計未刪除 material
-                    "last_activity": {"$max": "$submission_time"},
-                    "materials_attempted": {"$addToSet": "$material_id"}
-                }
-            },
-            {
-                "$lookup": {
-                    "from": "students",
-                    "localField": "_id",
-                    "foreignField": "_id",
-                    "as": "student_info"
-                }
-            },
-            {"$unwind": {"path": "$student_info", "preserveNullAndEmptyArrays": True}},
-            {
-                "$lookup": {
-                    "from": "users",
-                    "localField": "_id",
-                    "foreignField": "_id",
-                    "as": "user_info"
-                }
-            },
-            {"$unwind": {"path": "$user_info", "preserveNullAndEmptyArrays": True}},
-            # ✅ 加入 lookup materials 過濾已刪除
-            {
-                "$lookup": {
-                    "from": "materials",
-                    "let": {"attempted": "$materials_attempted"},
-                    "pipeline": [
-                        {
-                            "$match": {
-                                "$expr": {"$in": ["$_id", "$$attempted"]},
-                                "is_deleted": {"$ne": True}   # ← 只計未刪除
-                            }
-                        },
-                        {"$project": {"_id": 1}}
-                    ],
-                    "as": "valid_materials_attempted"
-                }
-            },
-            {
-                "$project": {
-                    "id": {"$toString": "$_id"},
-                    "name": {
-                        "$ifNull": [
-                            "$student_info.name",
-                            {"$ifNull": ["$user_info.username", "Unknown Student"]}
-                        ]
-                    },
-                    # ✅ 用 valid_materials_attempted（已過濾刪除）計 progress
-                    "progress": {
-                        "$min": [   # ← cap 至 100%
-                            100,
-                            {
-                                "$round": [
-                                    {
-                                        "$multiply": [
-                                            {"$divide": [
-                                                {"$size": "$valid_materials_attempted"},
-                                                total_materials_count
-                                            ]},
-                                            100
-                                        ]
-                                    },
-                                    0
-                                ]
-                            }
-                        ]
-                    },
-                    "avgQuizScore": {"$round": ["$avg_score", 0]},
-                    "lastActivity": "$last_activity",
-                    "totalSubmissions": "$total_submissions"
-                }
-            },
-            {"$sort": {"lastActivity": -1}}
-        ]
-
-        results = list(db.student_answers.aggregate(pipeline))
-        if not results:
+        # Per-student summaries are kept up to date on submit (utils/student_stats.py)
+        stats = list(db.student_stats.find().sort("last_activity", -1))
+        if not stats:
             return jsonify([]), 200
+
+        student_ids = [st["_id"] for st in stats]
+        names = {
+            u["_id"]: u.get("username")
+            for u in db.users.find({"_id": {"$in": student_ids}}, {"username": 1})
+        }
+        names.update({
+            st["_id"]: st.get("name")
+            for st in db.students.find({"_id": {"$in": student_ids}}, {"name": 1})
+            if st.get("name") is not None
+        })
+
+        results = []
+        for st in stats:
+            score_count = st.get("score_count", 0)
+            avg_score = st.get("score_sum", 0) / score_count if score_count else None
+            attempted = len(st.get("materials_attempted", []))
+            results.append({
+                "_id": str(st["_id"]),
+                "id": str(st["_id"]),
+                "name": names.get(st["_id"]) or "Unknown Student",
+                # ✅ cap 至 100%
+                "progress": min(100, round(attempted / total_materials_count * 100)),
+                "avgQuizScore": round(avg_score) if avg_score is not None else None,
+                "lastActivity": st.get("last_activity"),
+                "totalSubmissions": st.get("total_submissions", 0)
+            })
         return jsonify(results), 200
 
     except Exception as e:
@@ -161,102 +116,335 @@ def generate_ai_report():
 
         student_name = student.get('name') or student.get('username', 'Student')
 
-        submissions = list(db.student_answers.find({
-            "student_id": student_id,
-            "status": "submitted"
-        }).sort("submission_time", -1))
-
-        if not submissions:
+        force = bool(data.get('force', False))
+        report = generate_student_report(student_id, student_name, ObjectId(get_jwt_identity()), force)
+        if report is None:
             no_data_en = f"## No Data Available\n\n{student_name} has not completed any quizzes or assignments yet."
             no_data_zh = f"## 暫無資料\n\n{student_name} 尚未完成任何測驗或作業。"
             return jsonify({"report_en": no_data_en, "report_zh": no_data_zh}), 200
 
-        analytics_data = calculate_student_statistics_with_questions(submissions, student_name)
+        report_en, report_zh, reused, from_ai = report
+        return jsonify({
+            "report_en": report_en, "report_zh": report_zh, "reused": reused, "fallback": not from_ai
+        }), 200
 
-        from routes.ai import generate_performance_report, translate_report_to_chinese
+    except Exception as e:
+        print(f"Error in generate_ai_report: {str(e)}")
+        return jsonify({"error": "Failed to generate report", "details": str(e)}), 500
 
-        report_en = generate_performance_report(analytics_data)
-        report_zh = translate_report_to_chinese(report_en)
 
-        db.ai_reports.update_one(
-            {"student_id": student_id},
-            {"$set": {
-                "student_id": student_id,
-                "student_name": student_name,
-                "report_en": report_en,
-                "report_zh": report_zh,
-                "generated_at": datetime.utcnow(),
-                "generated_by": ObjectId(get_jwt_identity())
-            }},
-            upsert=True
+def get_submission_fingerprint(student_id):
+    """
+    Hash of what a student's report is built from: number of submissions,
+    latest submission_time and which attempted materials are deleted.
+    Returns None if the student has no submissions.
+    """
+    filt = {"student_id": student_id, "status": "submitted"}
+    count = db.student_answers.count_documents(filt)
+    if count == 0:
+        return None
+
+    latest = db.student_answers.find_one(filt, {"submission_time": 1}, sort=[("submission_time", -1)])
+    material_ids = db.student_answers.distinct("material_id", filt)
+    deleted = sorted(
+        str(m["_id"]) for m in db.materials.find(
+            {"_id": {"$in": material_ids}, "is_deleted": True},
+            {"_id": 1}
+        )
+    )
+
+    encoded = json.dumps([count, latest.get("submission_time"), deleted], default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def generate_student_report(student_id, student_name, generated_by, force=False):
+    """
+    Generate the EN + ZH report for one student and save it to ai_reports.
+    The stored report is reused without LLM calls when the student's
+    submissions haven't changed since it was generated, unless force is set.
+    Template or untranslated reports (LLM unavailable) are stored without a
+    fingerprint, so the next request tries the LLM again.
+    Returns (report_en, report_zh, reused, from_ai), or None if the student has no submissions.
+    """
+    from routes.ai import generate_performance_report, translate_report_to_chinese
+
+    fingerprint = get_submission_fingerprint(student_id)
+    if fingerprint is None:
+        return None
+
+    if not force:
+        stored = db.ai_reports.find_one(
+            {"student_id": student_id, "fingerprint": fingerprint},
+            {"report_en": 1, "report_zh": 1}
         )
+        if stored and stored.get("report_en") and stored.get("report_zh"):
+            print(f"[ANALYTICS] Report for {student_id} is up to date, skipping generation")
+            return stored["report_en"], stored["report_zh"], True, True
+
+    submissions = list(db.student_answers.find({
+        "student_id": student_id,
+        "status": "submitted"
+    }).sort("submission_time", -1))
+
+    analytics_data = calculate_student_statistics_with_questions(submissions, student_name)
+    report_en, en_from_ai = generate_performance_report(analytics_data)
+    report_zh, zh_from_ai = translate_report_to_chinese(report_en)
+    from_ai = en_from_ai and zh_from_ai
+
+    db.ai_reports.update_one(
+        {"student_id": student_id},
+        {"$set": {
+            "student_id": student_id,
+            "student_name": student_name,
+            "report_en": report_en,
+            "report_zh": report_zh,
+            "fingerprint": fingerprint if from_ai else None,
+            "generated_at": datetime.utcnow(),
+            "generated_by": generated_by
+        }},
+        upsert=True
+    )
+    return report_en, report_zh, False, from_ai
 
-        return jsonify({"report_en": report_en, "report_zh": report_zh}), 200
 
+def run_report_for_student(job_id, student_id, generated_by, force=False):
+    """Background worker: report for one student of a batch, checkpointed on the job."""
+    # Claim the student: only one runner (in any process) moves it from pending to in_progress
+    claimed = db.report_jobs.update_one(
+        {"_id": job_id, "pending": student_id},
+        {"$pull": {"pending": student_id}, "$push": {"in_progress": student_id},
+         "$set": {"updated_at": datetime.utcnow()}}
+    )
+    if not claimed.modified_count:
+        return
+
+    inc = {"processed": 1}
+    try:
+        student = db.students.find_one({"_id": student_id}) or db.users.find_one({"_id": student_id})
+        student_name = (student.get('name') or student.get('username', 'Student')) if student else 'Unknown'
+
+        report = generate_student_report(student_id, student_name, generated_by, force)
+        if report is None:
+            outcome = {"$push": {"failed": {"id": str(student_id), "error": "No submissions"}}}
+        elif not report[3]:
+            outcome = {"$push": {"failed": {"id": str(student_id), "error": "AI report unavailable"}}}
+        else:
+            outcome = {"$push": {"success": str(student_id)}}
+            if report[2]:
+                inc["reused"] = 1
     except Exception as e:
-        print(f"Error in generate_ai_report: {str(e)}")
-        return jsonify({"error": "Failed to generate report", "details": str(e)}), 500
+        outcome = {"$push": {"failed": {"id": str(student_id), "error": str(e)}}}
+
+    # No match if a resume handed the student back to pending meanwhile; the
+    # stored report is then reused by the resumed run, which counts it once
+    db.report_jobs.update_one(
+        {"_id": job_id, "in_progress": student_id},
+        {**outcome, "$pull": {"in_progress": student_id}, "$inc": inc,
+         "$set": {"updated_at": datetime.utcnow()}}
+    )
+
+
+def run_report_job(job_id):
+    """Background coordinator: fan the job's pending students out to the student pool."""
+    now = datetime.utcnow()
+    job = db.report_jobs.find_one_and_update(
+        {"_id": job_id, "status": "queued"},
+        {"$set": {"status": "running", "started_at": now, "updated_at": now}}
+    )
+    if not job:
+        print(f"[ANALYTICS] Report job {job_id} is gone or no longer queued, skipping")
+        return
+
+    try:
+        futures = [
+            background.submit(
+                REPORT_STUDENT_POOL, run_report_for_student,
+                job_id, student_id, job.get("created_by"), job.get("force", False)
+            )
+            for student_id in job.get("pending", [])
+        ]
+        for future in futures:
+            future.result()
+        db.report_jobs.update_one(
+            {"_id": job_id},
+            {"$set": {"status": "completed", "finished_at": datetime.utcnow()}}
+        )
+        print(f"[ANALYTICS] Report job {job_id} finished ({len(futures)} students)")
+    except Exception as e:
+        db.report_jobs.update_one(
+            {"_id": job_id},
+            {"$set": {"status": "failed", "error": str(e), "finished_at": datetime.utcnow()}}
+        )
+
+
+def stale_job_filter(cutoff):
+    """Queued/running report jobs whose process sent no heartbeat since cutoff."""
+    return {
+        "status": {"$in": ["queued", "running"]},
+        "$or": [{"heartbeat_at": {"$lt": cutoff}}, {"heartbeat_at": {"$exists": False}}],
+    }
+
+
+def fail_stale_report_job(job_id) -> bool:
+    """
+    Mark a job as failed when its process stopped sending heartbeats
+    report_job_stale_seconds ago (it died). Returns True if it was marked.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=report_job_stale_seconds)
+    result = db.report_jobs.update_one(
+        {"_id": job_id, **stale_job_filter(cutoff)},
+        {"$set": {
+            "status": "failed",
+            "error": "Report job was interrupted (server restarted); resume it to finish the remaining students",
+            "finished_at": datetime.utcnow(),
+        }}
+    )
+    return result.modified_count > 0
+
+
+def serialize_report_job(job):
+    def iso(dt):
+        return dt.isoformat() if isinstance(dt, datetime) else dt
+
+    return {
+        "job_id": str(job["_id"]),
+        "status": job.get("status"),
+        "total": job.get("total", 0),
+        "processed": job.get("processed", 0),
+        "reused": job.get("reused", 0),
+        "success": job.get("success", []),
+        "failed": job.get("failed", []),
+        "error": job.get("error"),
+        "created_at": iso(job.get("created_at")),
+        "started_at": iso(job.get("started_at")),
+        "finished_at": iso(job.get("finished_at")),
+    }
 
 
 @analytics_bp.route('/api/analytics/report/all', methods=['POST'])
 @jwt_required()
 def generate_all_reports():
     """
-    Generate and store AI reports for ALL students in one go
+    Queue a background job that generates and stores AI reports for ALL students.
+    Students whose submissions haven't changed keep their stored report unless
+    "force" is true. Poll /api/analytics/report/jobs/<job_id> for progress.
     """
     try:
-        from routes.ai import generate_performance_report, translate_report_to_chinese
+        data = request.get_json(silent=True) or {}
 
         students = list(db.student_answers.aggregate([
             {"$match": {"status": "submitted"}},
             {"$group": {"_id": "$student_id"}}
         ]))
+        student_ids = [s["_id"] for s in students]
+
+        job = {
+            "status": "queued",
+            "total": len(student_ids),
+            "processed": 0,
+            "reused": 0,
+            "force": bool(data.get("force", False)),
+            "pending": student_ids,
+            "in_progress": [],
+            "success": [],
+            "failed": [],
+            "error": None,
+            "created_by": ObjectId(get_jwt_identity()),
+            "worker": background.worker_id(),
+            "heartbeat_at": datetime.utcnow(),
+            "created_at": datetime.utcnow(),
+            "updated_at": datetime.utcnow(),
+            "started_at": None,
+            "finished_at": None,
+        }
+        job_id = db.report_jobs.insert_one(job).inserted_id
+        background.submit(REPORT_JOB_POOL, run_report_job, job_id)
+        print(f"[ANALYTICS] Queued report job {job_id} for {len(student_ids)} students")
 
-        results = {"success": [], "failed": []}
-
-        for s in students:
-            try:
-                student_id = s["_id"]
-                student = db.students.find_one({"_id": student_id}) or db.users.find_one({"_id": student_id})
-                student_name = (student.get('name') or student.get('username', 'Student')) if student else 'Unknown'
-
-                submissions = list(db.student_answers.find({
-                    "student_id": student_id,
-                    "status": "submitted"
-                }).sort("submission_time", -1))
-
-                if not submissions:
-                    results["failed"].append({"id": str(student_id), "error": "No submissions"})
-                    continue
-
-                analytics_data = calculate_student_statistics_with_questions(submissions, student_name)
-                report_en = generate_performance_report(analytics_data)
-                report_zh = translate_report_to_chinese(report_en)
-
-                db.ai_reports.update_one(
-                    {"student_id": student_id},
-                    {"$set": {
-                        "student_id": student_id,
-                        "student_name": student_name,
-                        "report_en": report_en,
-                        "report_zh": report_zh,
-                        "generated_at": datetime.utcnow(),
-                        "generated_by": ObjectId(get_jwt_identity())
-                    }},
-                    upsert=True
-                )
-                results["success"].append(str(student_id))
-
-            except Exception as e:
-                results["failed"].append({"id": str(s["_id"]), "error": str(e)})
-
-        return jsonify(results), 200
+        return jsonify(serialize_report_job(job)), 202
 
     except Exception as e:
         print(f"Error in generate_all_reports: {str(e)}")
         return jsonify({"error": "Failed to generate all reports", "details": str(e)}), 500
 
 
+@analytics_bp.route('/api/analytics/report/jobs/<job_id>', methods=['GET'])
+@jwt_required()
+def get_report_job(job_id):
+    """Progress of a batch report job."""
+    try:
+        try:
+            job_obj_id = ObjectId(job_id)
+        except Exception:
+            return jsonify({"error": "Invalid job_id format"}), 400
+
+        if fail_stale_report_job(job_obj_id):
+            print(f"[ANALYTICS] Report job {job_id} lost its server process, marked as failed")
+
+        job = db.report_jobs.find_one({"_id": job_obj_id}, {"pending": 0, "in_progress": 0})
+        if not job:
+            return jsonify({"error": "Job not found"}), 404
+
+        return jsonify(serialize_report_job(job)), 200
+
+    except Exception as e:
+        print(f"Error in get_report_job: {str(e)}")
+        return jsonify({"error": "Failed to fetch report job", "details": str(e)}), 500
+
+
+@analytics_bp.route('/api/analytics/report/jobs/<job_id>/resume', methods=['POST'])
+@jwt_required()
+def resume_report_job(job_id):
+    """
+    Re-queue the students a job has not processed yet, e.g. after a server restart.
+    Only failed jobs, or queued/running jobs without a heartbeat for
+    REPORT_JOB_STALE_SECONDS (their process died), can be resumed.
+    """
+    try:
+        try:
+            job_obj_id = ObjectId(job_id)
+        except Exception:
+            return jsonify({"error": "Invalid job_id format"}), 400
+
+        now = datetime.utcnow()
+        cutoff = now - timedelta(seconds=report_job_stale_seconds)
+        # Matching and re-queuing in one operation: concurrent resumes can't both win
+        job = db.report_jobs.find_one_and_update(
+            {
+                "_id": job_obj_id,
+                "$and": [
+                    {"$or": [{"pending.0": {"$exists": True}}, {"in_progress.0": {"$exists": True}}]},
+                    {"$or": [{"status": "failed"}, stale_job_filter(cutoff)]},
+                ],
+            },
+            {"$set": {"status": "queued", "error": None, "finished_at": None, "updated_at": now,
+                      "worker": background.worker_id(), "heartbeat_at": now}},
+            projection={"pending": 0}
+        )
+        if not job:
+            current = db.report_jobs.find_one({"_id": job_obj_id}, {"status": 1})
+            if current and current.get("status") in ("queued", "running"):
+                return jsonify({"error": "Job is still in progress"}), 409
+            return jsonify({"error": "Job not found or nothing left to resume"}), 404
+
+        # Students claimed by the dead run go back to pending
+        in_progress = job.get("in_progress") or []
+        if in_progress:
+            db.report_jobs.update_one(
+                {"_id": job_obj_id},
+                {"$addToSet": {"pending": {"$each": in_progress}}, "$pullAll": {"in_progress": in_progress}}
+            )
+        job.pop("in_progress", None)
+
+        background.submit(REPORT_JOB_POOL, run_report_job, job_obj_id)
+        job["status"] = "queued"
+        return jsonify(serialize_report_job(job)), 202
+
+    except Exception as e:
+        print(f"Error in resume_report_job: {str(e)}")
+        return jsonify({"error": "Failed to resume report job", "details": str(e)}), 500
+
+
 @analytics_bp.route('/api/analytics/report/<student_id>', methods=['GET'])
 @jwt_required()
 def get_stored_report(student_id):
@@ -282,10 +470,12 @@ def get_stored_report(student_id):
 
 def calculate_student_statistics_with_questions(submissions, student_name):
     
-    # ✅ 先取得所有未刪除 material 的 ID set
+    # ✅ 先取得學生做過而未刪除 material 的 ID set（只查 attempted，一次 query）
+    attempted_ids = list({s.get('material_id') for s in submissions if s.get('material_id')})
+    attempted_ids += [to_object_id(mid) for mid in attempted_ids if isinstance(mid, str)]
     valid_material_ids = set(
         str(m["_id"]) for m in db.materials.find(
-            {"is_deleted": {"$ne": True}},
+            {"_id": {"$in": attempted_ids}, "is_deleted": {"$ne": True}},
             {"_id": 1}
         )
     )
@@ -308,18 +498,28 @@ def calculate_student_statistics_with_questions(submissions, student_name):
 
     total_materials = db.materials.count_documents({"is_deleted": {"$ne": True}})
 
-    # ✅ 只計 materials_attempted 入面未被刪除的
-    valid_attempted_ids = [ObjectId(mid) for mid in materials_attempted if mid]
-    valid_attempted_count = db.materials.count_documents({
-        "_id": {"$in": valid_attempted_ids},
-        "is_deleted": {"$ne": True}
-    })
+    # ✅ 只計 materials_attempted 入面未被刪除的（valid_submissions 已過濾）
+    valid_attempted_count = len(materials_attempted)
 
     progress_percentage = min(
         100,  # ← cap 至 100%
         (valid_attempted_count / total_materials * 100) if total_materials > 0 else 0
     )
 
+    # ✅ 一次過攞晒有錯題 material 的 question doc（避免每題一個 query）
+    wrong_material_ids = list({
+        s.get('material_id') for s in valid_submissions
+        if any(not a.get('is_correct', False) for a in s.get('answers', []))
+    })
+    question_docs = {}
+    if wrong_material_ids:
+        for q in db.questions.find(
+            {"material_id": {"$in": wrong_material_ids}, "is_deleted": {"$ne": True}},
+            {"material_id": 1, "question_content": 1}
+        ):
+            # keep the first match per material, like find_one did
+            question_docs.setdefault(q.get('material_id'), q)
+
     # ✅ incorrect questions 也只從 valid submissions 計
     incorrect_questions = []
     correct_count = 0
@@ -337,7 +537,7 @@ def calculate_student_statistics_with_questions(submissions, student_name):
                 correct_count += 1
             else:
                 question_id = answer.get('question_id', '')
-                question_doc = db.questions.find_one({"material_id": material_id, "is_deleted": {"$ne": True}})
+                question_doc = question_docs.get(material_id)
 
                 if question_doc:
                     question_content = question_doc.get('question_content', {})
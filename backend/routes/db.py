@@ -3,9 +3,10 @@ from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 from bson.objectid import ObjectId
 from bson.errors import InvalidId
 from flask_bcrypt import Bcrypt
-import ast
 from datetime import datetime
 from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+from utils import data_access
+from utils import student_stats
 db = None
 SIGNER = None
 PUBLIC_BASE_URL = None
@@ -33,15 +34,63 @@ def serialize_datetime(dt):
         return dt.isoformat()
     return dt
 
-# Helper to normalize datetime values for JSON output
-def to_object_id(value):
-    """Convert string to ObjectId if valid, otherwise return as string."""
-    if not value:
-        return None
-    try:
-        return ObjectId(value)  # bson 自己有 validation
-    except Exception:
-        return value  # 保留原始 string（例如 AI-generated IDs）
+MAX_PAGE_SIZE = 200
+
+def get_page_args():
+    """
+    Reads ?limit= and ?cursor= for keyset pagination on _id.
+    limit is None when the caller didn't ask for pagination.
+    Raises ValueError on bad input.
+    """
+    limit = request.args.get('limit')
+    cursor = request.args.get('cursor')
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise ValueError("limit must be an integer")
+        if limit <= 0:
+            raise ValueError("limit must be positive")
+        limit = min(limit, MAX_PAGE_SIZE)
+    if cursor:
+        try:
+            cursor = ObjectId(cursor)
+        except (InvalidId, TypeError):
+            raise ValueError("Invalid cursor")
+    return limit, cursor or None
+
+def find_page(collection, filt, projection=None):
+    """
+    Find documents in _id order, one page at a time.
+    Returns (docs, next_cursor); next_cursor is None on the last page.
+    Without ?limit= the whole result is streamed from the cursor.
+    """
+    limit, after = get_page_args()
+    if after is not None:
+        filt = {"$and": [filt, {"_id": {"$gt": after}}]}
+    cursor = collection.find(filt, projection).sort("_id", 1)
+    if limit is None:
+        return cursor, None
+    docs = list(cursor.limit(limit + 1))
+    next_cursor = str(docs[limit - 1]["_id"]) if len(docs) > limit else None
+    return docs[:limit], next_cursor
+
+MAX_BULK_ITEMS = 1000
+
+def get_bulk_items(data, key):
+    """Returns (items, error) for a bulk request body like {key: [...]}."""
+    items = data.get(key) if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        return None, f"{key} must be a non-empty array"
+    if len(items) > MAX_BULK_ITEMS:
+        return None, f"At most {MAX_BULK_ITEMS} {key} per request"
+    return items, None
+
+def bulk_status(inserted, errors):
+    """201 when every item was stored, 207 when some failed, 400 when none were."""
+    if not errors:
+        return 201
+    return 207 if inserted else 400
 
 def getUserById(user_id):
     try:
@@ -72,37 +121,16 @@ def add_material():
         subtopic = request.form.get('subtopic', [])
         form = request.form.get('form', '')
         
-        user_id = ObjectId(request.form.get('user_id'))
+        user_id = request.form.get('user_id')
 
-        if not subject_id:
-            return jsonify({"error": "subject_id is required"}), 400
-        if not topic:
-            return jsonify({"error": "topic is required"}), 400
-        if not subtopic:
-            return jsonify({"error": "subtopic is required"}), 400
-        if not language:
-            return jsonify({"error": "language is required"}), 400
-        if not form:
-            return jsonify({"error": "form is required"}), 400
-
-        subtopic_list = ast.literal_eval(subtopic) if isinstance(subtopic, str) else subtopic
-
-        mat = {
-            'subject_id': ObjectId(subject_id),
-            'attribute': {
-                'topic': topic,
-                "subtopic": subtopic_list,
-                "form": form,
-                'language': language
-            },
-            'slides': slides,
-            'uploaded_by': user_id,
-            'created_by': user_id,  # ✅ 加 created_by，與 analytics 一致
-            'status': status,
-            'create_type': create_type,
-            'created_at': datetime.now().isoformat(),
-        }
-        mat_id = db.materials.insert_one(mat).inserted_id
+        try:
+            mat = data_access.create_material(
+                subject_id, topic, subtopic, form, language, user_id,
+                slides=slides, status=status, create_type=create_type
+            )
+        except ValueError as ve:
+            return jsonify({"error": str(ve)}), 400
+        mat_id = mat['_id']
         return jsonify({
             'result': 'Material uploaded successfully',
             'material_id': str(mat_id),
@@ -114,13 +142,63 @@ def add_material():
                 'language': language
             },
             'slides': slides,
-            "uploaded_by": str(user_id),
+            "uploaded_by": str(mat['uploaded_by']),
             'status': status,
             "upload_date": datetime.now().isoformat(),
         }), 201
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Response field -> stored fields it is built from
+MATERIAL_FIELDS = {
+    "subject_id": ["subject_id"],
+    "attribute": ["attribute"],
+    "slides": ["slides"],
+    "status": ["status"],
+    "uploaded_by": ["uploaded_by"],
+    "created_at": ["created_at"],
+    "video_url": ["video_url"],
+    "video_generated_at": ["video_generated_at"],
+}
+
+def get_material_fields():
+    """
+    Reads ?fields=a,b or ?view=summary|full and returns (fields, projection).
+    view=summary returns everything except slides. Raises ValueError on bad input.
+    """
+    fields = request.args.get('fields')
+    view = request.args.get('view', 'full')
+    if fields:
+        names = [f.strip() for f in fields.split(',') if f.strip()]
+        unknown = [f for f in names if f not in MATERIAL_FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    elif view == 'summary':
+        names = [f for f in MATERIAL_FIELDS if f != 'slides']
+    elif view == 'full':
+        names = list(MATERIAL_FIELDS)
+    else:
+        raise ValueError("view must be 'summary' or 'full'")
+    projection = {stored: 1 for name in names for stored in MATERIAL_FIELDS[name]}
+    return names, projection
+
+def serialize_material(m, fields):
+    result = {"id": str(m["_id"])}
+    for field in fields:
+        if field == "attribute":
+            attr = m.get("attribute") or {}
+            result["attribute"] = {
+                "topic": attr.get("topic"),
+                "subtopic": attr.get("subtopic"),
+                "form": attr.get("form"),
+                "language": attr.get("language")
+            }
+        elif field in ("subject_id", "uploaded_by"):
+            result[field] = str(m.get(field))
+        else:
+            result[field] = m.get(field)
+    return result
+
 # Get Materials
 @db_bp.route('/material', methods=['GET'])
 @jwt_required()
@@ -142,60 +220,56 @@ def get_material():
             filt['subject_id'] = ObjectId(subject_id)
         if uploaded_by:
             filt['uploaded_by'] = ObjectId(uploaded_by)
-        # check for new and old format
+        # attributes live under attribute.* only (see utils/migrate_schema.py)
         if topic:
-            filt["$or"] = [{"topic": topic}, {"attribute.topic": topic}]
+            filt["attribute.topic"] = topic
         if subtopic:
-            filt.setdefault("$and", []).append({"$or": [
-                    {"subtopic": {"$in": [subtopic] if isinstance(subtopic, str) else subtopic}},
-                    {"attribute.subtopic": {"$in": [subtopic] if isinstance(subtopic, str) else subtopic}}
-                ]
-            })
+            filt["attribute.subtopic"] = subtopic
         if form:
-            filt.setdefault("$and", []).append({
-                "$or": [
-                    {"form": form},
-                    {"attribute.form": form}
-                ]
-            })
+            filt["attribute.form"] = form
 
         print(f'MongoDB filter: {filt}')
 
         filt["is_deleted"] = {"$ne": True}
-        mats = list(db.materials.find(filt, {}))
-
-        print(f'Found {len(mats)} materials')
-        
-
-        if not mats and not filt:
-            all_mats = list(db.materials.find({}))
-            print(f'Sample materials in DB: {all_mats}')
+        try:
+            fields, projection = get_material_fields()
+            mats, next_cursor = find_page(db.materials, filt, projection)
+        except ValueError as ve:
+            return jsonify({"error": str(ve)}), 400
 
         materials = []
         for m in mats:
-            attr = m.get("attribute", {})  
-            materials.append({
-                "id": str(m["_id"]),
-                "subject_id": str(m.get("subject_id")),
-                "attribute": {
-                    "topic": attr.get("topic") or m.get("topic"),
-                    "subtopic": attr.get("subtopic") or m.get("subtopic"),
-                    "form": attr.get("form") or m.get("form"),
-                    "language": attr.get("language") or m.get("language")
-                },
-                "slides": m.get("slides"),
-                "uploaded_by": str(m.get("uploaded_by")),
-                "created_at": m.get("created_at"),
-                "video_url": m.get("video_url"),
-                "video_generated_at": m.get("video_generated_at")
-            })
+            materials.append(serialize_material(m, fields))
             
             # ✅ 只 log metadata，唔 log slides 內容
-            print(f'Material found: id={materials[-1]["id"]}, topic={materials[-1]["attribute"].get("topic")}, subject_id={materials[-1]["subject_id"]}')
+            print(f'Material found: id={m["_id"]}, topic={(m.get("attribute") or {}).get("topic")}, subject_id={m.get("subject_id")}')
             
+        print(f'Found {len(materials)} materials')
         if not materials:
             return jsonify({"message": "No materials found"}), 404
-        return jsonify({"materials": materials}), 200
+        return jsonify({"materials": materials, "next_cursor": next_cursor}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# Get one material in full, e.g. after listing with view=summary
+@db_bp.route('/material/<material_id>', methods=['GET'])
+@jwt_required()
+def get_material_detail(material_id):
+    try:
+        try:
+            material_obj_id = ObjectId(material_id)
+        except (InvalidId, TypeError):
+            return jsonify({"error": "Invalid material_id"}), 400
+
+        try:
+            fields, projection = get_material_fields()
+        except ValueError as ve:
+            return jsonify({"error": str(ve)}), 400
+
+        m = db.materials.find_one({"_id": material_obj_id, "is_deleted": {"$ne": True}}, projection)
+        if not m:
+            return jsonify({"message": "Material not found"}), 404
+        return jsonify({"material": serialize_material(m, fields)}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -235,6 +309,10 @@ def delete_material():
             {'material_id': ObjectId(material_id)},
             {"$set": {"is_deleted": True}}
         )
+        try:
+            student_stats.material_deleted(ObjectId(material_id))
+        except Exception as e:
+            print(f"Could not update student_stats after deleting material {material_id}: {e}")
         print(f"Material with id {material_id} and associated questions deleted successfully")
         return jsonify({"message": "Material deleted successfully"}), 200
     except Exception as e:
@@ -268,15 +346,7 @@ def update_material():
 
         print(f"Updating material {material_id} with status: {status}, and slides: {slides}")
 
-        db.materials.update_one(
-            {"_id": ObjectId(material_id)},
-            {
-                "$set": {
-                    "status": status,
-                    "slides": slides
-                }
-            }
-        )
+        data_access.update_material(material_id, slides, status)
 
         return jsonify({"message": "Material updated successfully"}), 200
     except Exception as e:
@@ -338,7 +408,10 @@ def get_users():
             filt["firstName"] = firstName
         if lastName:
             filt["lastName"] = lastName
-        docs = list(db.users.find(filt, {}))
+        try:
+            docs, next_cursor = find_page(db.users, filt, {"username": 1})
+        except ValueError as ve:
+            return jsonify({"error": str(ve)}), 400
         results = []
         for u in docs:
             results.append({
@@ -346,7 +419,7 @@ def get_users():
                 "username": u.get("username")
             })
         print("User search results:", results)
-        return jsonify({"users": results}), 200
+        return jsonify({"users": results, "next_cursor": next_cursor}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -473,32 +546,20 @@ def get_subject():
             else:
                 subj_filt['_id'] = {"$in": subject_ids}
 
-        subjects = list(db.subjects.find(subj_filt))
+        try:
+            subjects, next_cursor = find_page(db.subjects, subj_filt)
+        except ValueError as ve:
+            return jsonify({"error": str(ve)}), 400
+        subjects = list(subjects)
+
+        # Topics for all listed subjects in one query
+        topics_by_subject = {}
+        for t in db.topics.find({"subject_id": {"$in": [s.get('_id') for s in subjects]}}, {"subject_id": 1, "topic": 1}):
+            topics_by_subject.setdefault(t.get("subject_id"), []).append(t.get("topic"))
+
         results = []
-        
         for s in subjects:
-            sid = s.get('_id') 
-            
-            # Fetch topics linked to this subject 
-            topics_cursor = db.topics.find({"subject_id": sid}) 
-            topics_list = [t.get("topic") for t in topics_cursor] 
-            
-            # Fetch all subject_members that include this subject id 
-            members_cursor = db.subject_members.find({"subject_ids": sid}) 
-            teacher_ids = [] 
-            student_ids = [] 
-            
-            for m in members_cursor: 
-                uid = m.get("user_id") 
-                role = m.get("role") 
-                
-                uid_str = str(uid)
-                
-                if role == "teacher": 
-                    teacher_ids.append(uid_str) 
-                elif role == "student": 
-                    student_ids.append(uid_str)   
-                             
+            topics_list = topics_by_subject.get(s.get('_id'), [])
             results.append({
                 "id": str(s["_id"]),
                 "subject": s.get("subject"),
@@ -510,7 +571,7 @@ def get_subject():
                 "updated_at": serialize_datetime(s.get("updated_at"))
             })
         print("Subject search results:", results[:5])
-        return jsonify({"subjects": results}), 200
+        return jsonify({"subjects": results, "next_cursor": next_cursor}), 200
     
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -665,23 +726,10 @@ def add_question():
         if not question_content:
             return jsonify({"error": "question_content is required"}), 400
 
-        # Handle material_id - can be ObjectId or string
-        material_id_value = to_object_id(material_id)
-
-        doc = {
-            "material_id": material_id_value,
-            "question_content": question_content,
-            "created_by": to_object_id(created_by),
-            "create_type": create_type,
-            "created_at": datetime.now().isoformat(),
-            "updated_at": datetime.now().isoformat(),
-        }
+        question_id = data_access.create_question(material_id, question_content, created_by, create_type)
 
-        print("Inserting question document:", doc)
-        res = db.questions.insert_one(doc)
-        
         return jsonify({
-            "_id": str(res.inserted_id),
+            "_id": question_id,
             "message": "Question added successfully"
         }), 201
 
@@ -691,6 +739,26 @@ def add_question():
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
+# Add many Questions at once, e.g. importing a question bank
+@db_bp.route('/question-add-bulk', methods=['POST'])
+@jwt_required()
+def add_questions_bulk():
+    try:
+        data = request.get_json(silent=True) or {}
+        items, error = get_bulk_items(data, "questions")
+        if error:
+            return jsonify({"error": error}), 400
+
+        inserted, errors = data_access.create_questions(items, default_created_by=data.get("user_id") or get_jwt_identity())
+        print(f"Bulk question import: {len(inserted)} inserted, {len(errors)} failed")
+        return jsonify({"inserted": inserted, "errors": errors}), bulk_status(inserted, errors)
+
+    except Exception as e:
+        print(f"Error in add_questions_bulk: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
 # Update Question
 @db_bp.route('/question-update', methods=['PUT'])
 @jwt_required()
@@ -734,22 +802,16 @@ def get_question():
         filt = {}
         
         if material_id:
-            # Try to convert to ObjectId first, if it fails, use string
-            try:
-                # Check if it's a valid ObjectId format (24 hex chars)
-                if len(material_id) == 24 and all(c in '0123456789abcdefABCDEF' for c in material_id):
-                    filt['material_id'] = ObjectId(material_id)
-                else:
-                    # For AI-generated materials with string IDs like "material_1766495512_690dcb35"
-                    filt['material_id'] = material_id
-            except Exception as e:
-                print(f"material_id format error: {e}, using as string")
-                filt['material_id'] = material_id
+            # ObjectId for 24-hex ids; AI-generated ids like "material_1766495512_690dcb35" stay strings
+            filt['material_id'] = data_access.canonical_id(material_id)
         
         print(f"Querying questions with filter: {filt}")
         # ✅ 加過濾已刪除 questions
         filt["is_deleted"] = {"$ne": True}
-        questions = list(db.questions.find(filt))
+        try:
+            questions, next_cursor = find_page(db.questions, filt)
+        except ValueError as ve:
+            return jsonify({"error": str(ve)}), 400
         
         results = []
         for u in questions:
@@ -767,7 +829,7 @@ def get_question():
         
         print(f"Question search results: Found {len(results)} items")
         print(f"Questions: {results}")
-        return jsonify({"questions": results}), 200
+        return jsonify({"questions": results, "next_cursor": next_cursor}), 200
         
     except Exception as e:
         print(f"Error in get_question: {str(e)}")
@@ -781,68 +843,32 @@ def get_question():
 def submit_student_answers():
     try:
         data = request.get_json()
-        student_id = data.get("student_id") if isinstance(data, dict) else None 
-        if not student_id: 
-            try: 
-                student_id = get_jwt_identity() 
-                print("submit_student_answers: using JWT identity as student_id:", student_id) 
-            except Exception: 
-                student_id = None
-        material_id = data.get("material_id")
-        answers = data.get("answers")  # Format: [{"question_id": "xxx", "user_answer": "xxx", "is_correct": true/false, "score": 10}]
-        total_score = data.get("total_score")
-        submission_time = data.get("submission_time", datetime.now().isoformat())
-
-        if not student_id:
-            return jsonify({"error": "student_id is required"}), 400
-        if not material_id:
-            return jsonify({"error": "material_id is required"}), 400
-        if not answers:
-            return jsonify({"error": "answers is required"}), 400
+        if not isinstance(data, dict):
+            return jsonify({"error": "JSON body is required"}), 400
+        if not data.get("student_id"):
+            print("submit_student_answers: using JWT identity as student_id:", get_jwt_identity())
 
-        # Handle student_id and material_id - can be ObjectId or string
-        student_id_value = None
-        if student_id:
-            try:
-                if len(student_id) == 24 and all(c in '0123456789abcdefABCDEF' for c in student_id):
-                    student_id_value = ObjectId(student_id)
-                else:
-                    student_id_value = student_id
-            except:
-                student_id_value = student_id
-
-        material_id_value = None
-        if material_id:
-            try:
-                if len(material_id) == 24 and all(c in '0123456789abcdefABCDEF' for c in material_id):
-                    material_id_value = ObjectId(material_id)
-                else:
-                    material_id_value = material_id
-            except:
-                material_id_value = material_id
-
-        # Store answer record
-        submission = {
-            "student_id": student_id_value,
-            "material_id": material_id_value,
-            "answers": answers,
-            "total_score": total_score,
-            "submission_time": submission_time,
-            "status": "submitted"
-        }
+        try:
+            submission = data_access.build_submission(data, default_student_id=get_jwt_identity())
+        except ValueError as ve:
+            return jsonify({"error": str(ve)}), 400
 
         print(f"Inserting student answers submission: {submission}")
         res = db.student_answers.insert_one(submission)
+        try:
+            student_stats.record_submission(submission)
+        except Exception as e:
+            print(f"Could not update student_stats for submission {res.inserted_id}: {e}")
         
         return jsonify({
             "_id": str(res.inserted_id),
             "message": "Student answers submitted successfully",
             "submission": {
-                "student_id": str(student_id_value),
-                "material_id": str(material_id_value),
-                "answers": answers,
-                "total_score": total_score,
-                "submission_time": submission_time,
+                "student_id": str(submission["student_id"]),
+                "material_id": str(submission["material_id"]),
+                "answers": submission["answers"],
+                "total_score": submission["total_score"],
+                "submission_time": submission["submission_time"],
                 "status": "submitted"
             }
         }), 201
@@ -853,6 +879,33 @@ def submit_student_answers():
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
+# Submit many Student Answers at once, e.g. syncing offline answers
+@db_bp.route('/student-answers-submit-bulk', methods=['POST'])
+@jwt_required()
+def submit_student_answers_bulk():
+    try:
+        data = request.get_json(silent=True) or {}
+        items, error = get_bulk_items(data, "submissions")
+        if error:
+            return jsonify({"error": error}), 400
+
+        inserted, errors, submissions = data_access.create_submissions(items, default_student_id=get_jwt_identity())
+        print(f"Bulk student answers: {len(inserted)} inserted, {len(errors)} failed")
+
+        if submissions:
+            try:
+                student_stats.rebuild_student_stats(list({s["student_id"] for s in submissions}))
+            except Exception as e:
+                print(f"Could not update student_stats after bulk submit: {e}")
+
+        return jsonify({"inserted": inserted, "errors": errors}), bulk_status(inserted, errors)
+
+    except Exception as e:
+        print(f"Error in submit_student_answers_bulk: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
 # Get Student Answers
 @db_bp.route('/student-answers', methods=['GET'])
 @jwt_required()
@@ -876,25 +929,16 @@ def get_student_answers():
             student_id = current_user_id
         
         if student_id:
-            try:
-                if len(student_id) == 24 and all(c in '0123456789abcdefABCDEF' for c in student_id):
-                    filt['student_id'] = ObjectId(student_id)
-                else:
-                    filt['student_id'] = student_id
-            except:
-                filt['student_id'] = student_id
+            filt['student_id'] = data_access.canonical_id(student_id)
         
         if material_id:
-            try:
-                if len(material_id) == 24 and all(c in '0123456789abcdefABCDEF' for c in material_id):
-                    filt['material_id'] = ObjectId(material_id)
-                else:
-                    filt['material_id'] = material_id
-            except:
-                filt['material_id'] = material_id
+            filt['material_id'] = data_access.canonical_id(material_id)
         
         print(f"Querying student answers with filter: {filt}")
-        submissions = list(db.student_answers.find(filt))
+        try:
+            submissions, next_cursor = find_page(db.student_answers, filt)
+        except ValueError as ve:
+            return jsonify({"error": str(ve)}), 400
         
         results = []
         for s in submissions:
@@ -909,7 +953,7 @@ def get_student_answers():
             })
         
         print(f"Student answers search results: Found {len(results)} submissions")
-        return jsonify({"submissions": results}), 200
+        return jsonify({"submissions": results, "next_cursor": next_cursor}), 200
         
     except Exception as e:
         print(f"Error in get_student_answers: {str(e)}")
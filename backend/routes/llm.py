@@ -1,12 +1,14 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 
-import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util import Retry
-from utils.token_usage import token_tracker, get_token_usage
+from bson.objectid import ObjectId
+from utils.token_usage import token_tracker, get_token_usage, MATERIAL_ENDPOINT
+from utils.http_client import get_session
+from utils import data_access
+from utils import background
 
 import ast
+import time
 
 # --- Global DB Handlers ---
 
@@ -22,15 +24,18 @@ def init_db(db_instance):
 
 llm_bp = Blueprint('llm', __name__)
 
+MATERIAL_JOB_POOL = "material_generation"
+
 # DeepSeek AI Configuration (loaded from Flask app config)
 DEEPSEEK_API_KEY = None
 DEEPSEEK_BASE_URL = None
 DEEPSEEK_MODEL = None
+MATERIAL_STALE_SECONDS = 600
 
 @llm_bp.record_once
 def on_load(state):
     """Loads configuration variables from Flask app config."""
-    global DEEPSEEK_API_KEY, DEEPSEEK_BASE_URL, DEEPSEEK_MODEL
+    global DEEPSEEK_API_KEY, DEEPSEEK_BASE_URL, DEEPSEEK_MODEL, MATERIAL_STALE_SECONDS
     app = state.app
 
     # DeepSeek Configuration
@@ -38,35 +43,14 @@ def on_load(state):
     DEEPSEEK_BASE_URL = app.config.get("DEEPSEEK_BASE_URL")
     DEEPSEEK_MODEL = app.config.get("DEEPSEEK_MODEL")
 
+    background.register_pool(MATERIAL_JOB_POOL, app.config.get("MATERIAL_JOB_WORKERS", 4))
+    MATERIAL_STALE_SECONDS = app.config.get("MATERIAL_STALE_SECONDS", 600)
+
     print(f"DeepSeek API Key loaded: {'YES' if DEEPSEEK_API_KEY else 'NO'}")
     print(f"DeepSeek Base URL: {DEEPSEEK_BASE_URL}")
     print(f"DeepSeek Model: {DEEPSEEK_MODEL}")
 
 
-# --- Utility Functions ---
-
-
-def get_session(
-    retries=3,
-    backoff_factor=0.3,
-    status_forcelist=(500, 502, 504, 429),
-    session=None,
-) -> requests.Session:
-    """Custom retry logic for API calls."""
-    session = session or requests.Session()
-    retry = Retry(
-        total=retries,
-        read=retries,
-        connect=retries,
-        backoff_factor=backoff_factor,
-        status_forcelist=status_forcelist,
-    )
-    adapter = HTTPAdapter(max_retries=retry)
-    session.mount('http://', adapter)
-    session.mount('https://', adapter)
-    return session
-
-
 # --- DeepSeek AI Helper Functions ---
 
 
@@ -75,6 +59,8 @@ def call_deepseek_api(subject: str, topic: str, subtopic: list, form: str, instr
     Call DeepSeek API to generate teaching material in JSON format.
     Returns a JSON object with slides structure.
     """
+    import requests
+
     if not DEEPSEEK_API_KEY:
         raise Exception("DeepSeek API key is not configured")
 
@@ -166,6 +152,7 @@ Generate teaching slides in the following JSON format:
         }
 
         print(f"Calling DeepSeek API for topic: {topic}")
+        started = time.perf_counter()
         response = session.post(
             f"{DEEPSEEK_BASE_URL}/v1/chat/completions",
             json=payload,
@@ -173,13 +160,15 @@ Generate teaching slides in the following JSON format:
             timeout=60
         )
         response.raise_for_status()
+        latency_ms = (time.perf_counter() - started) * 1000
 
         result = response.json()
         
         # Track token usage for slide generation
         try:
             _, token_usage = get_token_usage(result)
-            token_tracker.add_usage(token_usage, "Slide Generation", endpoint="/material/create")
+            token_tracker.add_usage(token_usage, "Slide Generation", endpoint=MATERIAL_ENDPOINT,
+                                    latency_ms=latency_ms, model=DEEPSEEK_MODEL)
             print(f"[TOKEN_TRACKER] Token usage for material creation: {token_usage}")
         except Exception as track_err:
             print(f"[TOKEN_TRACKER] Warning: Could not track usage: {track_err}")
@@ -248,22 +237,56 @@ def build_material_slides_fallback(subject: str, topic: str, instruction: str) -
 # --- Material JSON Endpoints (DeepSeek AI) ---
 
 
+def run_material_generation(material_sid: str, subject: str, topic: str, subtopic: list,
+                            form: str, instruction: str, language: str, user_id: str = None):
+    """Background worker: generate slides for a material created with status "generating"."""
+    if not data_access.claim_material_generation(material_sid):
+        print(f"Material {material_sid} is no longer generating, skipping")
+        return
+
+    session_id = f"material-{material_sid}"
+    try:
+        token_tracker.start_session(session_id, user_id=user_id, material_id=material_sid)
+    except Exception as e:
+        print(f"[TOKEN_TRACKER] Warning: {e}")
+
+    try:
+        # Try to call DeepSeek AI, fall back to template if API fails
+        try:
+            material_json = call_deepseek_api(subject, topic, subtopic, form, instruction, language)
+            print("Material generated successfully using DeepSeek AI")
+            print(f"Material JSON: {material_json}")
+        except Exception as e:
+            print(f"DeepSeek API failed, using fallback: {e}")
+            material_json = build_material_slides_fallback(subject, topic, instruction)
+
+        # Update the material in the database with the generated content
+        data_access.update_material(material_sid, material_json, "completed")
+        print(f"Material successfully updated: {material_sid}")
+
+    except Exception as e:
+        print(f"Error generating material {material_sid}: {e}")
+        try:
+            data_access.set_material_status(material_sid, "failed", error=str(e))
+        except Exception as status_err:
+            print(f"Could not mark material {material_sid} as failed: {status_err}")
+    finally:
+        try:
+            token_tracker.end_tracking(session_id)
+        except Exception as e:
+            print(f"[TOKEN_TRACKER] Warning: Could not end session: {e}")
+
+
 @llm_bp.route('/material/create', methods=['POST'])
 @jwt_required()
 def material_create():
     """
     Endpoint for generating JSON-only teaching material using DeepSeek AI.
-    Returns a JSON 'slides' object.
+    Saves the material with status "generating" and returns its id right away;
+    slides are generated in the background. Poll /material/<sid>/status until
+    the status is "completed" (or "failed").
     """
     try:
-        # Initialize token tracking for this material generation session
-        try:
-            token_tracker.start_session()
-        except Exception as e:
-            print(f"[TOKEN_TRACKER] Warning: {e}")
-            import traceback
-            traceback.print_exc()
-
         data = request.form
 
         subject = (data.get("subject") or "").strip()
@@ -284,92 +307,30 @@ def material_create():
         if not subject or not topic:
             return jsonify({"error": "Subject and topic are required"}), 400
 
-        # Prepare to save material sets into /db/material-add
-
-        try:
-            base = request.host_url.rstrip('/')
-            auth_hdr = {}
-            auth = request.headers.get("Authorization")
-            if auth:
-                auth_hdr["Authorization"] = auth
-            
-            session = get_session()
-            url = f"{base}/db/material-add"
-
-            print(f"Preparing to post material via /db/material-add route at {url}")
-        except Exception as e:
-            raise Exception(f"Error preparing url: {str(e)}")
-        
         # Initialize material object first
-        # Make the POST request through /db/material-add
         try:
-            # Prepare file object
-            data = {
-                "subject_id": subject_id,
-                "topic": topic,
-                "slides": [],
-                "create_type": "generated",
-                "status": "generating",
-                "language": language,
-                "subtopic": raw_subtopic,
-                "form": form,
-                "user_id": current_user_id
-            }
-            print(f"Posting initial material record with data: {data}")
-            resp = session.post(
-                url,
-                data=data,
-                headers=auth_hdr,
-                timeout=30
+            print(f"Saving initial material record for topic: {topic}")
+            material_doc = data_access.create_material(
+                subject_id, topic, raw_subtopic, form, language, current_user_id,
+                slides=[], status="generating", create_type="generated"
             )
-            resp.raise_for_status()
-            material_result = resp.json()
-
-            print(f"Material successfully posted via /db/material-add: {material_result}")
-
+            material_sid = str(material_doc["_id"])
+            print(f"Material successfully saved: {material_sid}")
         except Exception as e:
-            raise Exception(f"Failed to save material via /db/material-add route: {str(e)}")
-
-        # Try to call DeepSeek AI, fall back to template if API fails
-        try:
-            material_json = call_deepseek_api(subject, topic, subtopic, form, instruction, language)
-            print("Material generated successfully using DeepSeek AI")
-            print(f"Material JSON: {material_json}")
-        except Exception as e:
-            print(f"DeepSeek API failed, using fallback: {e}")
-            material_json = build_material_slides_fallback(subject, topic, instruction)
-
-        # Update the material in the database with the generated content
-        # Make the PUT request through /db/material-update
-        material_sid = material_result.get("material_id", "")
-        url = f"{base}/db/material-update?material_id={material_sid}"
-        try:
-            update_data = {
-                "slides": material_json,
-                "status": "completed",
-            }
-
-            resp = session.put(
-                url,
-                json=update_data,
-                headers=auth_hdr,
-                timeout=30
-            )
-            resp.raise_for_status()
-            updated_result = resp.json()
+            raise Exception(f"Failed to save material: {str(e)}")
 
-            print(f"Material successfully updated via /db/material-update: {updated_result}")
-
-        except Exception as e:
-            raise Exception(f"Failed to update material via /db/material-update route: {str(e)}")
+        background.submit(
+            MATERIAL_JOB_POOL, run_material_generation,
+            material_sid, subject, topic, subtopic, form, instruction, language, current_user_id or None
+        )
 
         response = {
             "code": 0,
-            "message": "success",
+            "message": "accepted",
             "data": {
                 "sid": material_sid,
-                "status": "done",
-                "slides": material_json,
+                "status": "generating",
+                "slides": None,
                 "subject_id": subject_id,
                 "subject": subject,
                 'attribute': {
@@ -378,15 +339,59 @@ def material_create():
                     "form": form,
                     "language": language
                 },
-                "created_at": material_result.get("created_at"),
+                "created_at": material_doc.get("created_at"),
             },
         }
-        return jsonify(response), 200
+        return jsonify(response), 202
 
     except Exception as e:
         print(f"Error creating material JSON: {e}")
         return jsonify({"error": f"Internal Server Error: {str(e)}"}), 500
 
+
+@llm_bp.route('/material/<material_id>/status', methods=['GET'])
+@jwt_required()
+def material_status(material_id):
+    """
+    Reports the generation status of a material. Slides are only included
+    once the status is "completed", so polling stays cheap. A generation no
+    worker has touched for MATERIAL_STALE_SECONDS is reported (and stored) as failed.
+    """
+    try:
+        try:
+            material_obj_id = ObjectId(material_id)
+        except Exception:
+            return jsonify({"error": "Invalid material_id format"}), 400
+
+        material = db.materials.find_one(
+            {"_id": material_obj_id},
+            {"status": 1, "error": 1, "created_at": 1}
+        )
+        if not material:
+            return jsonify({"error": "Material not found"}), 404
+
+        status = material.get("status")
+        if status == "generating" and data_access.fail_stale_generation(material_obj_id, MATERIAL_STALE_SECONDS):
+            print(f"Material {material_id} generation went stale, marked as failed")
+            material = db.materials.find_one({"_id": material_obj_id}, {"status": 1, "error": 1, "created_at": 1})
+            status = material.get("status")
+
+        result = {
+            "sid": material_id,
+            "status": status,
+            "error": material.get("error"),
+            "created_at": material.get("created_at"),
+        }
+        if status == "completed":
+            slides_doc = db.materials.find_one({"_id": material_obj_id}, {"slides": 1}) or {}
+            result["slides"] = slides_doc.get("slides")
+
+        return jsonify(result), 200
+
+    except Exception as e:
+        print(f"Error fetching material status: {e}")
+        return jsonify({"error": f"Internal Server Error: {str(e)}"}), 500
+
 # --- Test/Debug Endpoints ---
 
 
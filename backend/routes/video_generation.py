@@ -1,28 +1,139 @@
-from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required
+from flask import Blueprint, request, jsonify, Response
+from flask_jwt_extended import jwt_required, verify_jwt_in_request, get_jwt_identity
 from bson import ObjectId
-from datetime import datetime
+from datetime import datetime, timedelta
+from pymongo.errors import DuplicateKeyError
 import subprocess
 import tempfile
 import os
 import shutil
 import sys
+import json
+import time
+import hashlib
+import threading
+from functools import lru_cache
 from pathlib import Path
-from utils.manim.generate_animation import generate_animation
-from utils.token_usage import token_tracker
+from utils.manim.cache import CodeCache, RenderCache, make_cache_key, link_file
+from utils.token_usage import token_tracker, SLIDE_VIDEO_ENDPOINT
+from utils import background
 
 video_gen_bp = Blueprint("video_generation", __name__)
 db = None
+code_cache = None
+render_cache = None
+code_cache_settings = {}
+_pipeline_lock = threading.Lock()
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 MANIM_DIR = BASE_DIR / "utils" / "manim"
 SCENE_PATH = MANIM_DIR / "scene.py"
 
+VIDEO_OUT_DIR = os.path.join("static", "generated_videos")
+RENDER_CACHE_DIR = os.path.join(VIDEO_OUT_DIR, "render_cache")
+
+VIDEO_JOB_POOL = "video_jobs"
+MANIM_RENDER_POOL = "manim_render"
+QUALITY_FLAGS = {"low": "-ql", "medium": "-qm", "high": "-qh"}
+JOB_DONE_STATUSES = ("completed", "failed")
+JOB_ACTIVE_STATUSES = ("queued", "running")
+# Each process refreshes heartbeat_at of the jobs it owns; jobs whose process
+# died stop being refreshed and are reported as failed after VIDEO_JOB_STALE_SECONDS
+JOB_HEARTBEAT_SECONDS = 30
+job_stale_seconds = 300
+EVENT_POLL_SECONDS = 1.0
+
 def init_video_generation(database, app):
-    global db
+    global db, render_cache, job_stale_seconds
     db = database
+    job_stale_seconds = app.config.get("VIDEO_JOB_STALE_SECONDS", 300)
+    code_cache_settings.update(
+        ttl_seconds=app.config.get("MANIM_CODE_CACHE_TTL_DAYS", 30) * 86400,
+        max_entries=app.config.get("MANIM_CODE_CACHE_MAX_ENTRIES", 5000)
+    )
+    if db is not None:
+        render_cache = RenderCache(
+            db.manim_render_cache, RENDER_CACHE_DIR,
+            ttl_seconds=app.config.get("MANIM_RENDER_CACHE_TTL_DAYS", 30) * 86400,
+            max_entries=app.config.get("MANIM_RENDER_CACHE_MAX_ENTRIES", 2000)
+        )
+        render_cache.ensure_indexes()
+        start_job_heartbeat()
+    background.register_pool(VIDEO_JOB_POOL, app.config.get("VIDEO_JOB_WORKERS", 2))
+    background.register_pool(MANIM_RENDER_POOL, get_render_workers(
+        app.config.get("MANIM_RENDER_WORKERS", 0), app.config.get("WEB_WORKERS", 1)
+    ))
     print("VIDEOGEN: Video generation module initialized")
 
+def start_job_heartbeat():
+    """Keep heartbeat_at fresh on the active video jobs this process queued."""
+    def beat():
+        db.video_jobs.update_many(
+            {"worker": background.worker_id(), "status": {"$in": list(JOB_ACTIVE_STATUSES)}},
+            {"$set": {"heartbeat_at": datetime.utcnow()}}
+        )
+
+    background.start_heartbeat("video-job-heartbeat", beat, JOB_HEARTBEAT_SECONDS)
+
+def is_stale(job: dict) -> bool:
+    heartbeat = job.get("heartbeat_at") or job.get("created_at")
+    if job.get("status") not in JOB_ACTIVE_STATUSES or not isinstance(heartbeat, datetime):
+        return False
+    return heartbeat < datetime.utcnow() - timedelta(seconds=job_stale_seconds)
+
+def expire_stale_jobs(filt: dict) -> int:
+    """Mark active jobs matching filt whose process stopped sending heartbeats as failed."""
+    now = datetime.utcnow()
+    error = "Job was interrupted (server restarted), please try again"
+    result = db.video_jobs.update_many(
+        {
+            **filt,
+            "status": {"$in": list(JOB_ACTIVE_STATUSES)},
+            "$or": [
+                {"heartbeat_at": {"$lt": now - timedelta(seconds=job_stale_seconds)}},
+                {"heartbeat_at": {"$exists": False}},
+            ],
+        },
+        {
+            "$set": {"status": "failed", "error": error, "finished_at": now},
+            "$unset": {"active": ""},
+            "$push": {"events": {"event": "job-failed", "slide": None, "at": now.isoformat(), "error": error}},
+        }
+    )
+    if result.modified_count:
+        print(f"VIDEOGEN: Marked {result.modified_count} stale job(s) as failed")
+    return result.modified_count
+
+def get_pipeline():
+    """
+    Imports the LLM -> Manim pipeline on first use (it loads prompts, dotenv and
+    log handlers) so API-only processes never pay for it.
+    Returns (iter_generate_animations, code_cache).
+    """
+    global code_cache
+    from utils.manim.generate_animation import iter_generate_animations, prompt_version
+
+    with _pipeline_lock:
+        if code_cache is None and db is not None:
+            code_cache = CodeCache(db.manim_code_cache, version=prompt_version(), **code_cache_settings)
+            code_cache.ensure_indexes()
+    return iter_generate_animations, code_cache
+
+def animation_model() -> str:
+    """Model the animation pipeline calls (already imported by get_pipeline)."""
+    from utils.manim.generate_animation import DEEPSEEK_MODEL
+    return DEEPSEEK_MODEL
+
+def get_render_workers(configured: int, web_workers: int = 1) -> int:
+    """
+    Concurrent manim processes per server process: the configured value, capped
+    at this process's share of the CPU cores (every server process has a pool).
+    """
+    share = max(1, (os.cpu_count() or 1) // max(1, web_workers))
+    if not configured or configured <= 0:
+        return share
+    return min(configured, share)
+
 def get_manim_command() -> str:
     if sys.platform == "darwin":
         homebrew_path = "/opt/homebrew/bin/manim"
@@ -50,12 +161,24 @@ def find_video_file(root_dir: str, material_id: str) -> str | None:
     return max(candidates, key=lambda x: x[0])[1] if candidates else None
 
 def save_video_to_static(video_path: str, material_id_str: str) -> str:
-    out_dir = os.path.join("static", "generated_videos")
-    os.makedirs(out_dir, exist_ok=True)
-    dest = os.path.join(out_dir, f"video_{material_id_str}.mp4")
-    shutil.copy(video_path, dest)
+    os.makedirs(VIDEO_OUT_DIR, exist_ok=True)
+    dest = os.path.join(VIDEO_OUT_DIR, f"video_{material_id_str}.mp4")
+    # Replace rather than overwrite: dest may be hard-linked to a render cache entry
+    link_file(video_path, dest)
     return f"static/generated_videos/video_{material_id_str}.mp4"
 
+@lru_cache(maxsize=1)
+def get_manim_version() -> str:
+    try:
+        proc = subprocess.run([get_manim_command(), "--version"], capture_output=True, text=True, timeout=60)
+        return proc.stdout.strip() or "unknown"
+    except Exception:
+        return "unknown"
+
+def get_render_key(safe_code: str, quality_flag: str) -> str:
+    scene_hash = hashlib.sha256(SCENE_PATH.read_bytes()).hexdigest() if SCENE_PATH.exists() else ""
+    return make_cache_key(safe_code, scene_hash, quality_flag, get_manim_version())
+
 def get_all_slides(material: dict) -> list[dict]:
     raw = material.get("slides", [])
 
@@ -81,223 +204,527 @@ def get_all_slides(material: dict) -> list[dict]:
         all_slides.append({"title": subtitle, "content": content_text})
     return all_slides
 
-@video_gen_bp.route("/api/generate-video/generate", methods=["POST"])
-# @jwt_required()
-def generate_video():
+
+def get_raw_slides(material: dict) -> list:
+    raw_data = material.get("slides", [])
+    if isinstance(raw_data, dict) and "slides" in raw_data:
+        return raw_data.get("slides") or []
+    return raw_data if isinstance(raw_data, list) else []
+
+def get_video_slides(raw_slides_list: list) -> list[tuple[int, dict]]:
+    """Returns (slide_number, slide_doc) for slides that get a video, skipping intro, conclusion and examples."""
+    selected = []
+    for idx in range(1, len(raw_slides_list) - 1):
+        slide_doc = raw_slides_list[idx]
+        slide_number = idx + 1 # 1-based index for UI/logging
+
+        # RULE: Skip if slideType is 'example'
+        if isinstance(slide_doc, dict) and slide_doc.get("slideType") == "example":
+            print(f"VIDEOGEN: Skipping slide {slide_number} because type is 'example'")
+            continue
+        selected.append((slide_number, slide_doc))
+    return selected
+
+def build_slide_text(slide_doc: dict, slide_number: int, topic: str) -> tuple[str, str]:
+    subtitle = slide_doc.get("subtitle", f"Slide {slide_number}")
+    contents = slide_doc.get("content", "")
+    content_text = " ".join(str(c) for c in contents) if isinstance(contents, list) else str(contents)
+    return subtitle, f"Topic: {topic}\n\n{subtitle}\n{content_text}"
+
+def get_material_context(material: dict) -> tuple[str, str]:
+    """Returns (language, topic) used to prompt the animation pipeline."""
+    language = "English"
+    try:
+        language = material.get('attribute', {}).get('language', 'English')
+    except:
+        pass
+    # attribute.topic is canonical; top-level topic only exists on unmigrated materials
+    topic = (
+        (material.get("attribute") or {}).get("topic")
+        or material.get("topic") or material.get("title") or "Educational Topic"
+    )
+    return language, topic
+
+def plan_video_slides(material: dict, quality_flag: str, force: bool = False) -> list[dict]:
     """
-    Generates separate videos for content slides.
-    Rules:
-    1. Ignores the first slide (Intro) and the last slide (Conclusion).
-    2. Ignores any slide where slideType == "example".
+    Works out which slides need a (new) video. A slide whose fingerprint
+    (position, text, language, quality) matches the one recorded when its
+    current video_url was generated is marked "unchanged" and keeps that URL.
     """
-    quality_flag = "-qm"
+    language, topic = get_material_context(material)
+    plan = []
+    for slide_number, slide_doc in get_video_slides(get_raw_slides(material)):
+        subtitle, slide_text = build_slide_text(slide_doc, slide_number, topic)
+        fingerprint = make_cache_key(slide_number, subtitle, slide_text, language, quality_flag)
+        unchanged = (
+            not force
+            and slide_doc.get("video_url")
+            and slide_doc.get("video_fingerprint") == fingerprint
+        )
+        plan.append({
+            "slide": slide_number,
+            "title": subtitle,
+            "slide_text": slide_text,
+            "fingerprint": fingerprint,
+            "status": "unchanged" if unchanged else "pending",
+            "videoUrl": slide_doc.get("video_url") if unchanged else None,
+        })
+    return plan
+
+def sanitize_code(manim_code_raw: str) -> str:
+    safe_code = manim_code_raw.encode("utf-8", errors="replace").decode("utf-8", errors="replace")
+    safe_code = "\n".join(line.rstrip() for line in safe_code.splitlines()).lstrip()
+    return safe_code.replace("MathTex(", "Text(").replace("Tex(", "Text(")
+
+def render_slide(safe_code: str, output_id: str, quality_flag: str) -> str | None:
+    """Renders one slide's Manim script and returns its static video URL, or None if nothing was produced."""
+    script_path = None
+    out_dir = None
     try:
-        if db is None:
-            return jsonify({"error": "Database not initialized"}), 500
-
+        with tempfile.NamedTemporaryFile(mode="w", suffix=".py", delete=False, encoding="utf-8") as f:
+            f.write(safe_code)
+            script_path = f.name
+
+        script_dir = os.path.dirname(script_path)
+        out_dir = tempfile.mkdtemp()
+
+        if SCENE_PATH.exists():
+            shutil.copy(SCENE_PATH, os.path.join(script_dir, "scene.py"))
+            shutil.copy(SCENE_PATH, os.path.join(out_dir, "scene.py"))
+
+        cmd = [get_manim_command(), quality_flag, script_path, "EducationalVideo", "-o", f"video_{output_id}"]
+
+        subprocess.run(cmd, cwd=out_dir, capture_output=True, text=True, encoding="utf-8", errors="ignore", timeout=600)
+
+        video_path = find_video_file(out_dir, output_id)
+        if not video_path:
+            return None
+        return save_video_to_static(video_path, output_id)
+    finally:
+        if script_path and os.path.exists(script_path): os.unlink(script_path)
+        if out_dir and os.path.isdir(out_dir): shutil.rmtree(out_dir, ignore_errors=True)
+
+def render_slide_part(job_id: ObjectId, slide_number: int, safe_code: str, output_id: str, quality_flag: str) -> dict:
+    """Render pool task: renders one slide (or reuses an identical render) and records its outcome on the job."""
+    render_key = get_render_key(safe_code, quality_flag)
+    cached_path = render_cache.get(render_key) if render_cache is not None else None
+    if cached_path:
         try:
-            token_tracker.start_session_tracking()
-            print("[TOKEN_TRACKER] Session tracking continued for video generation")
-        except Exception as te:
-            print(f"[TOKEN_TRACKER] Warning: {te}")
-            import traceback
-            traceback.print_exc()
+            video_url = save_video_to_static(cached_path, output_id)
+        except OSError:
+            # Evicted by another process between the lookup and the link: render it
+            cached_path = None
+
+    if cached_path:
+        print(f"VIDEOGEN: Render cache hit for slide {slide_number}")
+        record_event(job_id, "render-finished", slide_number, success=True, cached=True)
+    else:
+        set_slide_status(job_id, slide_number, "rendering")
+        record_event(job_id, "render-started", slide_number)
+        try:
+            video_url = render_slide(safe_code, output_id, quality_flag)
+        except subprocess.TimeoutExpired:
+            print(f"VIDEOGEN: Rendering timed out for slide {slide_number}")
+            video_url = None
+        if video_url and render_cache is not None:
+            try:
+                render_cache.put(render_key, video_url)
+            except Exception as e:
+                print(f"VIDEOGEN: Could not cache render for slide {slide_number}: {e}")
+        record_event(job_id, "render-finished", slide_number, success=bool(video_url), cached=False)
+    if not video_url:
+        print(f"VIDEOGEN: Render failed or empty for slide {slide_number}. Setting videoUrl to None.")
+    set_slide_status(job_id, slide_number, "done" if video_url else "failed", video_url)
+    record_event(job_id, "url", slide_number, videoUrl=video_url)
+    return {
+        "slide": slide_number,
+        "videoUrl": video_url,
+    }
+
+def save_videos_to_material(material_obj_id: ObjectId, videos: list[dict], fingerprints: dict[int, str], quality_flag: str):
+    """
+    Records the job's videos on the material's slides. Only video_url and
+    video_fingerprint of each slide are written, so edits made while the job
+    ran are kept; slides whose text changed since planning are left alone.
+    """
+    material = db.materials.find_one({"_id": material_obj_id})
+    if not material:
+        return
+    slides_field = "slides.slides" if isinstance(material.get("slides"), dict) else "slides"
+    current = {item["slide"]: item["fingerprint"] for item in plan_video_slides(material, quality_flag, force=True)}
+
+    to_set, to_unset = {}, {}
+    for part in videos:
+        slide_number = part["slide"]
+        fingerprint = fingerprints.get(slide_number)
+        if current.get(slide_number) != fingerprint:
+            print(f"VIDEOGEN: Slide {slide_number} was edited during generation, not saving its video")
+            continue
+        prefix = f"{slides_field}.{slide_number - 1}"
+        if part.get("videoUrl"):
+            to_set[f"{prefix}.video_url"] = part["videoUrl"]
+            to_set[f"{prefix}.video_fingerprint"] = fingerprint
+        else:
+            # Remove key so frontend doesn't show "Content Unavailable"
+            to_unset[f"{prefix}.video_url"] = ""
+            to_unset[f"{prefix}.video_fingerprint"] = ""
+
+    to_set.update(videoParts=videos, videoGeneratedAt=datetime.utcnow())
+    update = {"$set": to_set}
+    if to_unset:
+        update["$unset"] = to_unset
+    db.materials.update_one({"_id": material_obj_id}, update)
+
+def job_slides(plan: list[dict]) -> list[dict]:
+    return [{"slide": item["slide"], "status": item["status"], "videoUrl": item["videoUrl"]} for item in plan]
+
+def record_event(job_id: ObjectId, event: str, slide: int | None = None, **data):
+    """Appends a progress event to the job; streamed to clients by get_video_job_events."""
+    entry = {"event": event, "slide": slide, "at": datetime.utcnow().isoformat(), **data}
+    try:
+        db.video_jobs.update_one({"_id": job_id}, {"$push": {"events": entry}})
+    except Exception as e:
+        print(f"VIDEOGEN: Could not record event {event} for job {job_id}: {e}")
+
+def set_slide_status(job_id: ObjectId, slide_number: int, status: str, video_url: str | None = None):
+    db.video_jobs.update_one(
+        {"_id": job_id, "slides.slide": slide_number},
+        {"$set": {"slides.$.status": status, "slides.$.videoUrl": video_url}}
+    )
+
+def finish_job(job_id: ObjectId, status: str, error: str | None = None, videos: list | None = None):
+    update = {"status": status, "error": error, "finished_at": datetime.utcnow()}
+    if videos is not None:
+        update["videos"] = videos
+    # Dropping "active" lets the material get a new job
+    db.video_jobs.update_one({"_id": job_id}, {"$set": update, "$unset": {"active": ""}})
+    record_event(job_id, f"job-{status}", error=error, videos=videos)
+
+def serialize_job(job: dict) -> dict:
+    def iso(dt):
+        return dt.isoformat() if isinstance(dt, datetime) else dt
+
+    return {
+        "job_id": str(job["_id"]),
+        "material_id": str(job.get("material_id")),
+        "status": job.get("status"),
+        "quality": job.get("quality"),
+        "slides": job.get("slides", []),
+        "videos": job.get("videos", []),
+        "error": job.get("error"),
+        "created_at": iso(job.get("created_at")),
+        "started_at": iso(job.get("started_at")),
+        "finished_at": iso(job.get("finished_at")),
+    }
+
+def run_video_job(job_id: ObjectId):
+    """Background worker: storyboard -> code -> review -> render for each slide of a queued job."""
+    now = datetime.utcnow()
+    job = db.video_jobs.find_one_and_update(
+        {"_id": job_id, "status": "queued"},
+        {"$set": {"status": "running", "started_at": now, "heartbeat_at": now}}
+    )
+    if not job:
+        print(f"VIDEOGEN: Job {job_id} is gone or no longer queued, skipping")
+        return
+
+    session_id = str(job_id)
+    pending_renders = []
 
-        data = request.get_json(silent=True) or {}
-        material_id_str = data.get("material_id")
-        if not material_id_str:
-            return jsonify({"error": "material_id is required"}), 400
+    try:
+        token_tracker.start_session(session_id, user_id=job.get("requested_by"), material_id=str(job["material_id"]))
+        print("[TOKEN_TRACKER] Session started for video generation job")
+    except Exception as te:
+        print(f"[TOKEN_TRACKER] Warning: {te}")
 
-        try:
-            material_obj_id = ObjectId(material_id_str)
-        except Exception:
-            return jsonify({"error": "Invalid material_id format"}), 400
+    try:
+        material_obj_id = job["material_id"]
+        material_id_str = str(material_obj_id)
+        quality_flag = job.get("quality_flag", "-qm")
 
         material = db.materials.find_one({"_id": material_obj_id})
         if not material:
-            return jsonify({"error": "Material not found"}), 404
+            finish_job(job_id, "failed", "Material not found")
+            return
 
-        # 1. Get raw slides to check for slideType
-        raw_data = material.get("slides", [])
-        if isinstance(raw_data, dict) and "slides" in raw_data:
-            raw_slides_list = raw_data.get("slides") or []
-        else:
-            raw_slides_list = raw_data if isinstance(raw_data, list) else []
+        language, _ = get_material_context(material)
 
-        if len(raw_slides_list) < 3:
-            return jsonify({
-                "error": "Need at least 3 slides (intro, content, conclusion) to process"
-            }), 400
+        # Re-plan against the material as it is now; it may have been edited since the job was queued
+        plan = plan_video_slides(material, quality_flag, force=job.get("force", False))
+        db.video_jobs.update_one({"_id": job_id}, {"$set": {"slides": job_slides(plan)}})
 
-        # 2. Extract language and topic
-        language = "English"
-        try:
-            language = material.get('attribute', {}).get('language', 'English')
-        except:
-            pass
-        topic = material.get("topic") or material.get("title") or "Educational Topic"
+        fingerprints = {item["slide"]: item["fingerprint"] for item in plan}
+        unchanged = [{"slide": item["slide"], "videoUrl": item["videoUrl"]}
+                     for item in plan if item["status"] == "unchanged"]
+        changed = [item for item in plan if item["status"] != "unchanged"]
 
-        quality = data.get("quality", "medium")
-        quality_flag = {"low": "-ql", "medium": "-qm", "high": "-qh"}.get(quality, "-qm")
+        slide_numbers = [item["slide"] for item in changed]
+        batch = [{"title": item["title"], "slide_text": item["slide_text"]} for item in changed]
+        for slide_number in slide_numbers:
+            set_slide_status(job_id, slide_number, "generating")
 
-        videos = []
+        # Generate Manim code for all slides concurrently, once per slide to save time and tokens
+        def on_slide_event(idx, name, **event_data):
+            record_event(job_id, name, slide_numbers[idx], **event_data)
 
-        # 3. Iterate through slides, skipping first [0] and last [-1]
-        for idx in range(1, len(raw_slides_list) - 1):
-            slide_doc = raw_slides_list[idx]
-            slide_number = idx + 1 # 1-based index for UI/logging
+        for item in plan:
+            if item["status"] == "unchanged":
+                record_event(job_id, "url", item["slide"], videoUrl=item["videoUrl"], unchanged=True)
 
-            # RULE: Skip if slideType is 'example'
-            if isinstance(slide_doc, dict) and slide_doc.get("slideType") == "example":
-                print(f"VIDEOGEN: Skipping slide {slide_number} because type is 'example'")
-                continue
+        iter_generate_animations, cache = get_pipeline()
+        for idx, animation_output in iter_generate_animations(batch, language, cache=cache, on_event=on_slide_event):
+            slide_number = slide_numbers[idx]
 
-            # Prep slide content for Manim
-            subtitle = slide_doc.get("subtitle", f"Slide {slide_number}")
-            contents = slide_doc.get("content", "")
-            content_text = " ".join(str(c) for c in contents) if isinstance(contents, list) else str(contents)
-            
-            slide_text = f"Topic: {topic}\n\n{subtitle}\n{content_text}"
-
-            # Generate Manim code
-            # Call the function exactly ONCE to save time and tokens
-            animation_output = generate_animation(subtitle, slide_text, language)
-            
             if not animation_output:
-                continue # Or handle as error
-            
+                set_slide_status(job_id, slide_number, "failed")
+                continue
+
             # Safely unpack assuming the new return format is (manim_code, token_usage, time)
+            elapsed = None
             if isinstance(animation_output, tuple) and len(animation_output) >= 3:
-                manim_code_raw, token_usage, _ = animation_output
+                manim_code_raw, token_usage, elapsed = animation_output[:3]
             elif isinstance(animation_output, tuple):
                 manim_code_raw = animation_output[0]
                 token_usage = animation_output[1] if len(animation_output) > 1 else 0
             else:
                 manim_code_raw = animation_output
                 token_usage = 0
-            
+
             # Track token usage for this slide
             try:
                 if token_usage:
-                    token_tracker.add_usage(token_usage, f"Slide {slide_number} Video Generation", endpoint="/api/generate-video/generate")
+                    token_tracker.add_usage(
+                        token_usage, f"Slide {slide_number} Video Generation", endpoint=SLIDE_VIDEO_ENDPOINT,
+                        latency_ms=elapsed * 1000 if elapsed else None, model=animation_model()
+                    )
                     print(f"[TOKEN_TRACKER] Token usage for slide {slide_number}: {token_usage}")
             except Exception as track_err:
                 print(f"[TOKEN_TRACKER] Warning: Could not track usage: {track_err}")
-            
+
             if not manim_code_raw:
-                return jsonify({
-                    "error": f"Failed to generate animation code for slide {slide_number}"
-                }), 500
-            
-            # Sanitize and format code
-            safe_code = manim_code_raw.encode("utf-8", errors="replace").decode("utf-8", errors="replace")
-            safe_code = "\n".join(line.rstrip() for line in safe_code.splitlines()).lstrip()
-            safe_code = safe_code.replace("MathTex(", "Text(").replace("Tex(", "Text(")
+                set_slide_status(job_id, slide_number, "failed")
+                for future in pending_renders:
+                    future.cancel()
+                finish_job(job_id, "failed", f"Failed to generate animation code for slide {slide_number}")
+                return
+
+            safe_code = sanitize_code(manim_code_raw)
 
             # Early syntax check
             try:
                 compile(safe_code, f"gen-{slide_number}", "exec")
             except SyntaxError as e:
                 print(f"Syntax Error in slide {slide_number}: {e}")
+                set_slide_status(job_id, slide_number, "failed")
                 continue
 
-            script_path = None
-            out_dir = None
-            try:
-                with tempfile.NamedTemporaryFile(mode="w", suffix=".py", delete=False, encoding="utf-8") as f:
-                    f.write(safe_code)
-                    script_path = f.name
-
-                script_dir = os.path.dirname(script_path)
-                out_dir = tempfile.mkdtemp()
-
-                scene_src = MANIM_DIR / "scene.py"
-                if scene_src.exists():
-                    shutil.copy(scene_src, os.path.join(script_dir, "scene.py"))
-                    shutil.copy(scene_src, os.path.join(out_dir, "scene.py"))
-
-                output_id = f"{material_id_str}_slide{slide_number}"
-                cmd = [get_manim_command(), quality_flag, script_path, "EducationalVideo", "-o", f"video_{output_id}"]
-
-                proc = subprocess.run(cmd, cwd=out_dir, capture_output=True, text=True, encoding="utf-8", errors="ignore", timeout=600)
-
-                video_path = find_video_file(out_dir, output_id)
-                if video_path:
-                    video_url = save_video_to_static(video_path, output_id)
-                    videos.append({
-                        "slide": slide_number,
-                        "videoUrl": video_url,
-                    })
-                else:
-                    print(f"VIDEOGEN: Render failed or empty for slide {slide_number}. Setting videoUrl to None.")
-                    videos.append({
-                        "slide": slide_number,
-                        "videoUrl": None,
-                    })
-            finally:
-                if script_path and os.path.exists(script_path): os.unlink(script_path)
-                if out_dir and os.path.isdir(out_dir): shutil.rmtree(out_dir, ignore_errors=True)
-
-        # 4. Update Database
-        if isinstance(raw_data, dict) and "slides" in raw_data:
-            slides_doc = raw_data.get("slides") or []
-            
-            # Map video results to the slides
-            for part in videos:
-                idx = part["slide"] - 1
-                if 0 <= idx < len(slides_doc):
-                    if part.get("videoUrl"):
-                        slides_doc[idx]["video_url"] = part["videoUrl"]
-                    else:
-                        # Remove key so frontend doesn't show "Content Unavailable"
-                        slides_doc[idx].pop("video_url", None)
-
-            db.materials.update_one(
-                {"_id": material_obj_id},
-                {
-                    "$set": {
-                        "slides.slides": slides_doc, 
-                        "videoParts": videos, 
-                        "videoGeneratedAt": datetime.utcnow()
-                    }
-                }
-            )
-        else:
-            slides_list = raw_data if isinstance(raw_data, list) else []
-            
-            for part in videos:
-                idx = part["slide"] - 1
-                if 0 <= idx < len(slides_list):
-                    if part.get("videoUrl"):
-                        slides_list[idx]["video_url"] = part["videoUrl"]
-                    else:
-                        # Remove key so frontend doesn't show "Content Unavailable"
-                        slides_list[idx].pop("video_url", None)
-
-            db.materials.update_one(
-                {"_id": material_obj_id},
-                {
-                    "$set": {
-                        "slides": slides_list, 
-                        "videoParts": videos, 
-                        "videoGeneratedAt": datetime.utcnow()
-                    }
-                }
-            )
+            # Render in the shared pool while other slides are still being generated
+            pending_renders.append(background.submit(
+                MANIM_RENDER_POOL, render_slide_part, job_id, slide_number, safe_code,
+                f"{material_id_str}_slide{slide_number}", quality_flag
+            ))
+
+        rendered = [future.result() for future in pending_renders]
+        pending_renders = []
+        videos = sorted(rendered + unchanged, key=lambda part: part["slide"])
+        save_videos_to_material(material_obj_id, videos, fingerprints, quality_flag)
+        finish_job(job_id, "completed", videos=videos)
+        print(f"VIDEOGEN: Job {job_id} generated {len(rendered)} videos, kept {len(unchanged)} unchanged (skipped intro, conclusion, and examples)")
+
+    except Exception as e:
+        for future in pending_renders:
+            future.cancel()
+        finish_job(job_id, "failed", f"Failed to generate video: {e}")
+    finally:
         # End tracking after all videos are generated
         try:
-            token_tracker.end_tracking()
+            token_tracker.end_tracking(session_id)
             print("[TOKEN_TRACKER] Session ended after video generation")
         except Exception as e:
             print(f"[TOKEN_TRACKER] Warning: Could not end session: {e}")
-            
+
+@video_gen_bp.route("/api/generate-video/generate", methods=["POST"])
+# @jwt_required()
+def generate_video():
+    """
+    Queues separate video generation for content slides and returns a job id.
+    Rules:
+    1. Ignores the first slide (Intro) and the last slide (Conclusion).
+    2. Ignores any slide where slideType == "example".
+    3. Keeps the existing video of slides unchanged since their last generation
+       unless "force" is true.
+    A material has at most one queued/running job: while one is active, its
+    job id is returned (200, "existing": true) instead of queuing another.
+    Poll /api/generate-video/jobs/<job_id> for per-slide progress.
+    """
+    try:
+        if db is None:
+            return jsonify({"error": "Database not initialized"}), 500
+
+        data = request.get_json(silent=True) or {}
+        material_id_str = data.get("material_id")
+        if not material_id_str:
+            return jsonify({"error": "material_id is required"}), 400
+
+        try:
+            material_obj_id = ObjectId(material_id_str)
+        except Exception:
+            return jsonify({"error": "Invalid material_id format"}), 400
+
+        material = db.materials.find_one({"_id": material_obj_id})
+        if not material:
+            return jsonify({"error": "Material not found"}), 404
+
+        if len(get_raw_slides(material)) < 3:
+            return jsonify({
+                "error": "Need at least 3 slides (intro, content, conclusion) to process"
+            }), 400
+
+        expire_stale_jobs({"material_id": material_obj_id})
+        active_job = db.video_jobs.find_one({"material_id": material_obj_id, "active": True})
+        if active_job:
+            return existing_job_response(active_job)
+
+        quality = data.get("quality", "medium")
+        quality_flag = QUALITY_FLAGS.get(quality, "-qm")
+
+        force = bool(data.get("force", False))
+        slides = job_slides(plan_video_slides(material, quality_flag, force))
+
+        # The route is open, but a sent token still attributes the job's LLM usage to its user
+        try:
+            verify_jwt_in_request(optional=True)
+            requested_by = get_jwt_identity()
+        except Exception:
+            requested_by = None
+
+        job = {
+            "material_id": material_obj_id,
+            "requested_by": requested_by,
+            "quality": quality,
+            "quality_flag": quality_flag,
+            "force": force,
+            "status": "queued",
+            # Unique per material while set (partial index), cleared when the job ends
+            "active": True,
+            "worker": background.worker_id(),
+            "heartbeat_at": datetime.utcnow(),
+            "slides": slides,
+            "videos": [],
+            "events": [],
+            "error": None,
+            "created_at": datetime.utcnow(),
+            "started_at": None,
+            "finished_at": None,
+        }
+        try:
+            job_id = db.video_jobs.insert_one(job).inserted_id
+        except DuplicateKeyError:
+            # Another request queued a job for this material in the meantime
+            active_job = db.video_jobs.find_one({"material_id": material_obj_id, "active": True})
+            if not active_job:
+                raise
+            return existing_job_response(active_job)
+        background.submit(VIDEO_JOB_POOL, run_video_job, job_id)
+        print(f"VIDEOGEN: Queued job {job_id} for material {material_id_str} ({len(slides)} slides)")
+
         return jsonify({
             "success": True,
-            "videos": videos,
-            "message": f"Generated {len(videos)} videos (skipped intro, conclusion, and examples)",
-        }), 200
+            "job_id": str(job_id),
+            "status": "queued",
+            "slides": slides,
+        }), 202
+
+    except Exception as e:
+        return jsonify({"error": "Failed to queue video generation", "details": str(e)}), 500
+
+
+def existing_job_response(job: dict):
+    print(f"VIDEOGEN: Material {job['material_id']} already has active job {job['_id']}")
+    return jsonify({
+        "success": True,
+        "job_id": str(job["_id"]),
+        "status": job.get("status"),
+        "slides": job.get("slides", []),
+        "existing": True,
+    }), 200
+
+
+@video_gen_bp.route("/api/generate-video/jobs/<job_id>", methods=["GET"])
+# @jwt_required()
+def get_video_job(job_id):
+    """Reports the status of a video generation job and each of its slides."""
+    try:
+        if db is None:
+            return jsonify({"error": "Database not initialized"}), 500
+
+        try:
+            job_obj_id = ObjectId(job_id)
+        except Exception:
+            return jsonify({"error": "Invalid job_id format"}), 400
+
+        job = db.video_jobs.find_one({"_id": job_obj_id})
+        if not job:
+            return jsonify({"error": "Job not found"}), 404
+        if is_stale(job) and expire_stale_jobs({"_id": job_obj_id}):
+            job = db.video_jobs.find_one({"_id": job_obj_id})
+
+        return jsonify(serialize_job(job)), 200
 
-    except subprocess.TimeoutExpired:
-        return jsonify({"error": "Video rendering timed out"}), 408
     except Exception as e:
-        return jsonify({"error": "Failed to generate video", "details": str(e)}), 500
\ No newline at end of file
+        return jsonify({"error": "Failed to fetch video job", "details": str(e)}), 500
+
+
+@video_gen_bp.route("/api/generate-video/jobs/<job_id>/events", methods=["GET"])
+# @jwt_required()
+def get_video_job_events(job_id):
+    """
+    Streams a job's progress as Server-Sent Events until it finishes.
+    Each frame is `data: {"event": ..., "slide": ..., ...}`; the stream ends
+    with `data: [DONE]`. Reconnecting clients resume via Last-Event-ID.
+    """
+    if db is None:
+        return jsonify({"error": "Database not initialized"}), 500
+
+    try:
+        job_obj_id = ObjectId(job_id)
+    except Exception:
+        return jsonify({"error": "Invalid job_id format"}), 400
+
+    if not db.video_jobs.find_one({"_id": job_obj_id}, {"_id": 1}):
+        return jsonify({"error": "Job not found"}), 404
+
+    try:
+        start = int(request.headers.get("Last-Event-ID", -1)) + 1
+    except ValueError:
+        start = 0
+
+    def generate():
+        sent = start
+        idle_polls = 0
+        while True:
+            job = db.video_jobs.find_one(
+                {"_id": job_obj_id},
+                {"status": 1, "heartbeat_at": 1, "created_at": 1, "events": {"$slice": [sent, 1000]}}
+            )
+            if not job:
+                yield f"data: {json.dumps({'event': 'job-failed', 'error': 'Job not found'})}\n\n"
+                break
+            if is_stale(job) and expire_stale_jobs({"_id": job_obj_id}):
+                # The job-failed event was just appended; pick it up on the next poll
+                continue
+            events = job.get("events", [])
+            for event in events:
+                yield f"id: {sent}\ndata: {json.dumps(event, default=str)}\n\n"
+                sent += 1
+            if any(e.get("event") in ("job-completed", "job-failed") for e in events):
+                break
+            # Job finished without a final event (e.g. stream resumed after it): stop after one quiet poll
+            if job.get("status") in JOB_DONE_STATUSES and not events:
+                idle_polls += 1
+                if idle_polls > 1:
+                    break
+            time.sleep(EVENT_POLL_SECONDS)
+        yield "data: [DONE]\n\n"
+
+    return Response(generate(), mimetype='text/event-stream')
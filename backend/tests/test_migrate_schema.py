@@ -0,0 +1,66 @@
+from bson import ObjectId
+
+from utils.migrate_schema import ID_FIELDS, id_updates, material_update
+
+HEX_ID = "64b7f0c2a1b2c3d4e5f60718"
+
+
+def test_id_updates_converts_hex_string_ids():
+    doc = {"student_id": HEX_ID, "material_id": HEX_ID.upper()}
+    updates = id_updates(doc, ID_FIELDS["student_answers"])
+    assert updates == {"student_id": ObjectId(HEX_ID), "material_id": ObjectId(HEX_ID.upper())}
+
+
+def test_id_updates_keeps_canonical_and_generated_ids():
+    doc = {
+        "material_id": "material_1766495512_690dcb35",  # AI-generated id stays a string
+        "created_by": ObjectId(HEX_ID),
+    }
+    assert id_updates(doc, ID_FIELDS["questions"]) == {}
+
+
+def test_id_updates_ignores_missing_fields():
+    assert id_updates({}, ID_FIELDS["materials"]) == {}
+
+
+def test_material_update_moves_legacy_fields_into_attribute():
+    doc = {"subject_id": HEX_ID, "topic": "Algebra", "form": "F4", "language": "en"}
+    assert material_update(doc) == {
+        "$set": {
+            "subject_id": ObjectId(HEX_ID),
+            "attribute": {"topic": "Algebra", "form": "F4", "language": "en"},
+        },
+        "$unset": {"topic": "", "form": "", "language": ""},
+    }
+
+
+def test_material_update_prefers_existing_attribute_values():
+    doc = {
+        "topic": "Old topic",
+        "subtopic": ["Linear"],
+        "attribute": {"topic": "Algebra", "subtopic": []},
+    }
+    # attribute.topic wins; the empty attribute.subtopic is filled from the legacy field
+    assert material_update(doc) == {
+        "$set": {"attribute.subtopic": ["Linear"]},
+        "$unset": {"topic": "", "subtopic": ""},
+    }
+
+
+def test_material_update_leaves_canonical_documents_alone():
+    doc = {
+        "subject_id": ObjectId(HEX_ID),
+        "uploaded_by": ObjectId(HEX_ID),
+        "attribute": {"topic": "Algebra", "form": "F4"},
+    }
+    assert material_update(doc) is None
+
+
+def test_new_questions_use_the_migrated_id_form():
+    from utils.data_access import build_question
+
+    doc = build_question(HEX_ID, {"questions": []}, "teacher_12ch")
+    assert doc["material_id"] == ObjectId(HEX_ID)
+    # 12-character strings are not ObjectIds
+    assert doc["created_by"] == "teacher_12ch"
+    assert id_updates(doc, ID_FIELDS["questions"]) == {}
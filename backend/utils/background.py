@@ -0,0 +1,94 @@
+import os
+import socket
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+# Long-running work (video rendering, LLM batches) is handed off to named
+# thread pools so the HTTP request can return immediately. Each task runs
+# inside an app context so it can use the same helpers as the routes.
+
+_app = None
+_pools = {}
+_executors = {}
+_heartbeats = set()
+_lock = threading.Lock()
+
+
+def init_background(app):
+    """Remember the Flask app so tasks can push an app context."""
+    global _app
+    _app = app
+
+
+def register_pool(name: str, max_workers: int):
+    """Declare a named pool; the executor is created lazily on first submit."""
+    with _lock:
+        _pools[name] = max(1, int(max_workers or 1))
+
+
+def _get_executor(name: str) -> ThreadPoolExecutor:
+    with _lock:
+        executor = _executors.get(name)
+        if executor is None:
+            executor = ThreadPoolExecutor(
+                max_workers=_pools.get(name, 1),
+                thread_name_prefix=f"bg-{name}"
+            )
+            _executors[name] = executor
+        return executor
+
+
+def submit(name: str, fn, *args, **kwargs):
+    """Run fn(*args, **kwargs) on the named pool inside an app context."""
+    if _app is None:
+        raise RuntimeError("Background tasks not initialized")
+    app = _app
+
+    def run():
+        with app.app_context():
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                print(f"[BACKGROUND] Task on pool '{name}' failed")
+                traceback.print_exc()
+                raise
+
+    return _get_executor(name).submit(run)
+
+
+def worker_id() -> str:
+    """Identifies this server process on job documents (host:pid)."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def start_heartbeat(name: str, fn, interval: float):
+    """
+    Call fn() every interval seconds on a daemon thread (started once per name).
+    Jobs refresh a heartbeat_at field this way so others can tell when the
+    process that owns them died.
+    """
+    with _lock:
+        if name in _heartbeats:
+            return
+        _heartbeats.add(name)
+
+    def beat():
+        while True:
+            time.sleep(interval)
+            try:
+                fn()
+            except Exception as e:
+                print(f"[BACKGROUND] Heartbeat '{name}' failed: {e}")
+
+    threading.Thread(target=beat, name=name, daemon=True).start()
+
+
+def shutdown(wait: bool = True):
+    """Stop accepting tasks and optionally wait for running ones to finish."""
+    with _lock:
+        executors = list(_executors.values())
+        _executors.clear()
+    for executor in executors:
+        executor.shutdown(wait=wait)
@@ -0,0 +1,238 @@
+from bson.objectid import ObjectId
+from pymongo.errors import BulkWriteError
+from datetime import datetime, timedelta
+import ast
+import re
+
+# In-process data access shared by the db blueprint and the AI/LLM
+# blueprints, so generation endpoints write materials and questions
+# directly instead of calling their own HTTP routes.
+
+db = None
+
+
+def init_db(db_instance):
+    global db
+    db = db_instance
+
+
+def to_object_id(value):
+    """Convert string to ObjectId if valid, otherwise return as string."""
+    if not value:
+        return None
+    try:
+        return ObjectId(value)  # bson 自己有 validation
+    except Exception:
+        return value  # 保留原始 string（例如 AI-generated IDs）
+
+
+_HEX_ID = re.compile(r"^[0-9a-fA-F]{24}$")
+
+
+def canonical_id(value):
+    """ObjectId for a 24-hex string id; anything else (e.g. AI-generated ids) is kept as is."""
+    if isinstance(value, str) and _HEX_ID.match(value):
+        return ObjectId(value)
+    return value
+
+
+def insert_many_reporting(collection, docs: list[tuple[int, dict]]):
+    """
+    insert_many(ordered=False) for (index, doc) pairs, where index is the item's
+    position in the request. Returns (inserted, errors) with per-item results.
+    """
+    if not docs:
+        return [], []
+    failed = {}
+    try:
+        collection.insert_many([doc for _, doc in docs], ordered=False)
+    except BulkWriteError as e:
+        for err in e.details.get("writeErrors", []):
+            failed[err["index"]] = err.get("errmsg", "write error")
+
+    inserted, errors = [], []
+    for position, (index, doc) in enumerate(docs):
+        if position in failed:
+            errors.append({"index": index, "error": failed[position]})
+        else:
+            inserted.append({"index": index, "_id": str(doc["_id"])})
+    return inserted, errors
+
+
+# Materials
+
+def create_material(subject_id, topic, subtopic, form, language, user_id,
+                    slides=None, status="generating", create_type="undefined") -> dict:
+    """
+    Insert a material record. Raises ValueError when a required field is missing.
+    Returns the stored document (with _id).
+    """
+    if not subject_id:
+        raise ValueError("subject_id is required")
+    if not topic:
+        raise ValueError("topic is required")
+    if not subtopic:
+        raise ValueError("subtopic is required")
+    if not language:
+        raise ValueError("language is required")
+    if not form:
+        raise ValueError("form is required")
+
+    subtopic_list = ast.literal_eval(subtopic) if isinstance(subtopic, str) else subtopic
+    user_obj_id = ObjectId(user_id)
+
+    mat = {
+        'subject_id': ObjectId(subject_id),
+        'attribute': {
+            'topic': topic,
+            "subtopic": subtopic_list,
+            "form": form,
+            'language': language
+        },
+        'slides': slides,
+        'uploaded_by': user_obj_id,
+        'created_by': user_obj_id,  # ✅ 加 created_by，與 analytics 一致
+        'status': status,
+        'create_type': create_type,
+        'created_at': datetime.now().isoformat(),
+    }
+    if status == "generating":
+        # Refreshed when a worker picks the generation up; see fail_stale_generation
+        mat['heartbeat_at'] = datetime.utcnow()
+    mat['_id'] = db.materials.insert_one(mat).inserted_id
+    return mat
+
+
+def update_material(material_id, slides, status):
+    db.materials.update_one(
+        {"_id": ObjectId(material_id)},
+        {
+            "$set": {
+                "status": status,
+                "slides": slides
+            }
+        }
+    )
+
+
+def set_material_status(material_id, status, error=None):
+    db.materials.update_one(
+        {"_id": ObjectId(material_id)},
+        {"$set": {"status": status, "error": error}}
+    )
+
+
+def claim_material_generation(material_id) -> bool:
+    """
+    Called by the worker before it starts generating. Returns False when the
+    material is no longer "generating" (e.g. it was already reported as stale).
+    """
+    result = db.materials.update_one(
+        {"_id": ObjectId(material_id), "status": "generating"},
+        {"$set": {"heartbeat_at": datetime.utcnow()}}
+    )
+    return result.matched_count > 0
+
+
+def fail_stale_generation(material_id, stale_seconds: int) -> bool:
+    """
+    Mark a generation as failed when no worker has touched it for stale_seconds
+    (its worker died or was restarted). Returns True if it was marked.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=stale_seconds)
+    result = db.materials.update_one(
+        {
+            "_id": ObjectId(material_id),
+            "status": "generating",
+            "$or": [{"heartbeat_at": {"$lt": cutoff}}, {"heartbeat_at": {"$exists": False}}],
+        },
+        {"$set": {"status": "failed", "error": "Generation was interrupted, please try again"}}
+    )
+    return result.modified_count > 0
+
+
+# Questions
+
+def build_question(material_id, question_content, created_by, create_type="undefined") -> dict:
+    """Validate and build a question set document. Raises ValueError."""
+    if not question_content:
+        raise ValueError("question_content is required")
+
+    return {
+        # Same id forms as get_question and the schema migration: 24-hex strings
+        # become ObjectIds, other ids (e.g. AI-generated) stay strings
+        "material_id": canonical_id(material_id) if material_id else None,
+        "question_content": question_content,
+        "created_by": canonical_id(created_by) if created_by else None,
+        "create_type": create_type,
+        "created_at": datetime.now().isoformat(),
+        "updated_at": datetime.now().isoformat(),
+    }
+
+
+def create_question(material_id, question_content, created_by, create_type="undefined") -> str:
+    """Insert a question set for a material and return its id."""
+    doc = build_question(material_id, question_content, created_by, create_type)
+    print("Inserting question document:", doc)
+    return str(db.questions.insert_one(doc).inserted_id)
+
+
+def create_questions(items: list, default_created_by):
+    """Bulk insert question sets; returns (inserted, errors) per item index."""
+    docs, errors = [], []
+    for index, item in enumerate(items):
+        try:
+            if not isinstance(item, dict):
+                raise ValueError("item must be an object")
+            docs.append((index, build_question(
+                item.get("material_id"),
+                item.get("question_content"),
+                item.get("user_id") or default_created_by,
+                item.get("create_type", "undefined")
+            )))
+        except ValueError as ve:
+            errors.append({"index": index, "error": str(ve)})
+    inserted, write_errors = insert_many_reporting(db.questions, docs)
+    return inserted, sorted(errors + write_errors, key=lambda e: e["index"])
+
+
+# Student answers
+
+def build_submission(data: dict, default_student_id=None) -> dict:
+    """Validate and build a student_answers document. Raises ValueError."""
+    student_id = data.get("student_id") or default_student_id
+    material_id = data.get("material_id")
+    answers = data.get("answers")  # Format: [{"question_id": "xxx", "user_answer": "xxx", "is_correct": true/false, "score": 10}]
+
+    if not student_id:
+        raise ValueError("student_id is required")
+    if not material_id:
+        raise ValueError("material_id is required")
+    if not answers:
+        raise ValueError("answers is required")
+
+    # student_id and material_id can be ObjectId or string
+    return {
+        "student_id": canonical_id(student_id),
+        "material_id": canonical_id(material_id),
+        "answers": answers,
+        "total_score": data.get("total_score"),
+        "submission_time": data.get("submission_time", datetime.now().isoformat()),
+        "status": "submitted"
+    }
+
+
+def create_submissions(items: list, default_student_id=None):
+    """Bulk insert submissions; returns (inserted, errors, submissions) per item index."""
+    docs, errors = [], []
+    for index, item in enumerate(items):
+        try:
+            if not isinstance(item, dict):
+                raise ValueError("item must be an object")
+            docs.append((index, build_submission(item, default_student_id)))
+        except ValueError as ve:
+            errors.append({"index": index, "error": str(ve)})
+    inserted, write_errors = insert_many_reporting(db.student_answers, docs)
+    failed = {e["index"] for e in write_errors}
+    submissions = [doc for index, doc in docs if index not in failed]
+    return inserted, sorted(errors + write_errors, key=lambda e: e["index"]), submissions
@@ -0,0 +1,83 @@
+import os
+import threading
+
+# One keep-alive session shared by every DeepSeek caller in the process, so
+# requests reuse pooled TCP/TLS connections instead of handshaking each time.
+# pool_block caps the number of open connections per host at POOL_MAXSIZE;
+# extra callers wait for a free connection. Streaming calls (the SSE chat)
+# hold their connection for the whole stream, so they use a separate,
+# non-blocking session and can't starve the other callers.
+#
+# LLM calls are billed, non-idempotent POSTs: only failures where the server
+# did not process the request are retried (connection errors, 429/502/503),
+# never read timeouts or 500/504.
+
+POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", 20))
+RETRIES = int(os.getenv("HTTP_RETRIES", 3))
+BACKOFF_FACTOR = float(os.getenv("HTTP_BACKOFF_FACTOR", 1.0))
+RETRY_STATUSES = (429, 502, 503)
+
+_session = None
+_stream_session = None
+_lock = threading.Lock()
+
+
+def _build_session(pool_block: bool = True):
+    # requests is imported on first use so processes that never call an LLM don't load it
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util import Retry
+
+    retry = Retry(
+        total=RETRIES,
+        connect=RETRIES,
+        read=0,  # the request may already have been processed (and billed)
+        other=0,
+        status=RETRIES,
+        backoff_factor=BACKOFF_FACTOR,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=None,  # LLM calls are POSTs; the statuses above are safe to retry for them
+        respect_retry_after_header=True,
+        raise_on_status=False,  # hand back the last response so raise_for_status() gives an HTTPError
+    )
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=POOL_MAXSIZE,
+        pool_block=pool_block,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_session():
+    """Shared pooled session (created on first use)."""
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+
+def get_stream_session():
+    """Session for long-lived streaming responses; its pool never blocks callers."""
+    global _stream_session
+    if _stream_session is None:
+        with _lock:
+            if _stream_session is None:
+                _stream_session = _build_session(pool_block=False)
+    return _stream_session
+
+
+def close_session():
+    """Close pooled connections, e.g. on worker shutdown."""
+    global _session, _stream_session
+    with _lock:
+        for session in (_session, _stream_session):
+            if session is not None:
+                session.close()
+        _session = None
+        _stream_session = None
@@ -0,0 +1,92 @@
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+
+# Every index the app's queries rely on, declared in one place.
+# ensure_indexes() is idempotent: it runs at startup and can be run by hand:
+#     python -m utils.indexes
+# Cache collections (manim_code_cache, manim_render_cache) manage their own
+# indexes in utils/manim/cache.py because their TTL settings come from config.
+
+INDEXES = {
+    "users": [
+        ([("username", ASCENDING)], {"unique": True}),
+    ],
+    "materials": [
+        ([("subject_id", ASCENDING), ("is_deleted", ASCENDING)], {}),
+        ([("uploaded_by", ASCENDING)], {}),
+        ([("attribute.topic", ASCENDING)], {}),
+        ([("is_deleted", ASCENDING)], {}),
+    ],
+    "questions": [
+        ([("material_id", ASCENDING)], {}),
+    ],
+    "student_answers": [
+        # per-student report queries sort by submission_time
+        ([("student_id", ASCENDING), ("status", ASCENDING), ("submission_time", DESCENDING)], {}),
+        ([("material_id", ASCENDING)], {}),
+        ([("status", ASCENDING)], {}),
+    ],
+    "topics": [
+        ([("subject_id", ASCENDING)], {}),
+    ],
+    "subject_members": [
+        ([("user_id", ASCENDING)], {}),
+        ([("subject_ids", ASCENDING)], {}),
+    ],
+    "ai_reports": [
+        ([("student_id", ASCENDING)], {"unique": True}),
+    ],
+    "student_stats": [
+        ([("last_activity", DESCENDING)], {}),
+        ([("materials_attempted", ASCENDING)], {}),
+    ],
+    "video_jobs": [
+        # stale-job checks and job lookups by material
+        ([("material_id", ASCENDING), ("status", ASCENDING)], {}),
+        # At most one queued/running job per material. Its own key pattern: servers
+        # before MongoDB 5.0 refuse a second index on the same keys with other options
+        ([("material_id", ASCENDING), ("active", ASCENDING)], {
+            "unique": True, "partialFilterExpression": {"active": True}
+        }),
+        ([("worker", ASCENDING), ("status", ASCENDING)], {}),
+    ],
+    "report_jobs": [
+        # heartbeat of the jobs a process owns
+        ([("worker", ASCENDING), ("status", ASCENDING)], {}),
+    ],
+    "token_sessions": [
+        # TTL index: MongoDB deletes a session once its expires_at has passed
+        ([("expires_at", ASCENDING)], {"expireAfterSeconds": 0}),
+    ],
+    "llm_operations": [
+        # kept 90 days (token_usage.MAX_METRICS_DAYS)
+        ([("created_at", ASCENDING)], {"expireAfterSeconds": 90 * 24 * 3600}),
+        ([("endpoint", ASCENDING), ("created_at", ASCENDING)], {}),
+    ],
+}
+
+
+def ensure_indexes(db) -> list[str]:
+    """Create any missing index. Returns the names of indexes that could not be created."""
+    failed = []
+    for collection, specs in INDEXES.items():
+        for keys, options in specs:
+            try:
+                db[collection].create_index(keys, **options)
+            except OperationFailure as e:
+                # e.g. duplicate usernames block the unique index; the app still starts
+                name = f"{collection}." + "_".join(f"{field}_{order}" for field, order in keys)
+                print(f"[INDEXES] Could not create {name}: {e}")
+                failed.append(name)
+    print(f"[INDEXES] Indexes ensured ({len(failed)} failed)")
+    return failed
+
+
+if __name__ == "__main__":
+    from pymongo import MongoClient
+    from config import Config
+
+    client = MongoClient(Config.MONGO_URI)
+    failed = ensure_indexes(client.get_default_database())
+    client.close()
+    raise SystemExit(1 if failed else 0)
@@ -4,7 +4,6 @@ import sys
 
 BACKEND_ROOT = Path(__file__).resolve().parent.parent
 LOG_DIR = BACKEND_ROOT / "logs"
-LOG_DIR.mkdir(parents=True, exist_ok=True)
 
 def setup_logging(log_level=logging.INFO, current_file=None):
     """Configure logging with both file and console handlers."""
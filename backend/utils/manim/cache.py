@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import shutil
+from datetime import datetime, timedelta
+
+
+def make_cache_key(*parts) -> str:
+    """Stable sha256 over the JSON encoding of the given parts."""
+    encoded = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class CodeCache:
+    """
+    Mongo-backed cache of validated Manim code, keyed by a hash of the slide
+    (title, text, language) and `version`, which should change whenever the
+    prompts or model change. Entries expire after ttl_seconds (TTL index on
+    expires_at) and the least recently used entries are evicted once the
+    collection exceeds max_entries.
+    """
+
+    def __init__(self, collection, version: str, ttl_seconds: int, max_entries: int):
+        self.collection = collection
+        self.version = version
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+
+    def key_for(self, title: str, slide_text: str, language: str) -> str:
+        return make_cache_key(title, slide_text, language, self.version)
+
+    def ensure_indexes(self):
+        self.collection.create_index("expires_at", expireAfterSeconds=0)
+        self.collection.create_index("last_used_at")
+
+    def get(self, key: str) -> str | None:
+        now = datetime.utcnow()
+        doc = self.collection.find_one_and_update(
+            {"_id": key, "expires_at": {"$gt": now}},
+            {"$set": {"last_used_at": now}, "$inc": {"hits": 1}},
+            projection={"code": 1}
+        )
+        return doc.get("code") if doc else None
+
+    def put(self, key: str, code: str, **metadata):
+        now = datetime.utcnow()
+        self.collection.update_one(
+            {"_id": key},
+            {
+                "$set": {
+                    "code": code,
+                    "metadata": metadata,
+                    "last_used_at": now,
+                    "expires_at": now + timedelta(seconds=self.ttl_seconds),
+                },
+                "$setOnInsert": {"created_at": now, "hits": 0},
+            },
+            upsert=True
+        )
+        self._evict()
+
+    def _evict(self):
+        if not self.max_entries:
+            return
+        overflow = self.collection.estimated_document_count() - self.max_entries
+        if overflow <= 0:
+            return
+        stale = self.collection.find({}, {"_id": 1}).sort("last_used_at", 1).limit(overflow)
+        self.collection.delete_many({"_id": {"$in": [d["_id"] for d in stale]}})
+
+
+class RenderCache:
+    """
+    Maps a render key (hash of code, scene.py, quality flag and manim version)
+    to a rendered mp4 kept under store_dir as <key>.mp4. Stored files are never
+    written to again, so they can be hard-linked to per-slide output names.
+    Entries unused for ttl_seconds, and the least recently used ones once there
+    are more than max_entries, are evicted on put() together with their files;
+    per-slide videos linked from an evicted file keep their own copy.
+    """
+
+    def __init__(self, collection, store_dir, ttl_seconds: int, max_entries: int):
+        self.collection = collection
+        self.store_dir = store_dir
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+
+    def ensure_indexes(self):
+        self.collection.create_index("last_used_at")
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.store_dir, f"{key}.mp4")
+
+    def get(self, key: str) -> str | None:
+        """Path of the cached video for key, or None on a miss."""
+        doc = self.collection.find_one_and_update(
+            {"_id": key},
+            {"$set": {"last_used_at": datetime.utcnow()}, "$inc": {"hits": 1}}
+        )
+        if not doc:
+            return None
+        path = doc.get("video_path")
+        if not path or not os.path.exists(path):
+            # File was cleaned up behind our back
+            self.collection.delete_one({"_id": key})
+            return None
+        return path
+
+    def put(self, key: str, video_path: str):
+        os.makedirs(self.store_dir, exist_ok=True)
+        cached_path = self.path_for(key)
+        if not os.path.exists(cached_path):
+            link_file(video_path, cached_path)
+        now = datetime.utcnow()
+        self.collection.update_one(
+            {"_id": key},
+            {
+                "$set": {"video_path": cached_path, "last_used_at": now},
+                "$setOnInsert": {"created_at": now, "hits": 0},
+            },
+            upsert=True
+        )
+        self._evict()
+        return cached_path
+
+    def _evict(self):
+        # No TTL index: the mp4 has to be removed along with its entry
+        if self.ttl_seconds:
+            cutoff = datetime.utcnow() - timedelta(seconds=self.ttl_seconds)
+            for doc in self.collection.find({"last_used_at": {"$lt": cutoff}}, {"last_used_at": 1, "video_path": 1}):
+                self._remove(doc)
+        if self.max_entries:
+            overflow = self.collection.estimated_document_count() - self.max_entries
+            if overflow > 0:
+                stale = self.collection.find({}, {"last_used_at": 1, "video_path": 1}).sort("last_used_at", 1).limit(overflow)
+                for doc in stale:
+                    self._remove(doc)
+
+    def _remove(self, doc):
+        # Skip entries another process used (or already evicted) since we read them
+        result = self.collection.delete_one({"_id": doc["_id"], "last_used_at": doc.get("last_used_at")})
+        path = doc.get("video_path")
+        if result.deleted_count and path:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+
+def link_file(src: str, dest: str):
+    """Hard-link src to dest (copy if the filesystem can't), replacing dest."""
+    if os.path.abspath(src) == os.path.abspath(dest):
+        return
+    if os.path.exists(dest):
+        os.unlink(dest)
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copy(src, dest)
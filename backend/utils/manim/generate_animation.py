@@ -11,17 +11,28 @@ import tempfile
 import traceback
 import time
 import ast
+import threading
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 PROMPT_DIR = Path(__file__).parent / "prompt"
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
 from logger import setup_logging
 from token_usage import get_token_usage
+try:
+    from utils.http_client import get_session
+except ImportError:  # run as a script from utils/manim
+    from http_client import get_session
 load_dotenv()
 
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
 DEEPSEEK_BASE_URL = os.getenv("DEEPSEEK_BASE_URL")
 DEEPSEEK_MODEL = "deepseek-chat" 
+# Upper bound on concurrent DeepSeek requests from this process
+DEEPSEEK_MAX_IN_FLIGHT = int(os.getenv("DEEPSEEK_MAX_IN_FLIGHT", 4))
+
+_in_flight = threading.BoundedSemaphore(DEEPSEEK_MAX_IN_FLIGHT)
 
 logger = setup_logging(current_file=Path(__file__).stem)
 
@@ -46,6 +57,15 @@ def load_boilerplate() -> str:
     return load_prompt(PROMPT_DIR / "boilerplate_api_doc.txt")
 
 
+def prompt_version() -> str:
+    """Hash of every prompt file plus the model; changes whenever generated code could."""
+    digest = hashlib.sha256(DEEPSEEK_MODEL.encode("utf-8"))
+    for prompt_file in sorted(PROMPT_DIR.glob("*.txt")):
+        digest.update(prompt_file.name.encode("utf-8"))
+        digest.update(prompt_file.read_bytes())
+    return digest.hexdigest()
+
+
 def call_deepseek(system_prompt: str, user_prompt: str, temperature: float = 0.7, max_tokens: int = 2500):
     if not DEEPSEEK_API_KEY:
         raise Exception("DEEPSEEK_API_KEY environment variable is not set")
@@ -72,44 +92,20 @@ def call_deepseek(system_prompt: str, user_prompt: str, temperature: float = 0.7
     if "reasoning" in DEEPSEEK_MODEL.lower():
         payload["max_tokens"] = 8000
 
-    max_retries = 3
-    last_exception = None
-
-    for attempt in range(max_retries):
-        try:
-            response = requests.post(
-                f"{DEEPSEEK_BASE_URL}/v1/chat/completions",
-                headers=headers,
-                json=payload,
-                timeout=300
-            )
-            response.raise_for_status()
-            return response.json()
-        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
-            last_exception = e
-            if attempt == max_retries:
-                logger.error(f"All {max_retries} attempts failed due to network error: {e}")
-                raise
-            wait = 2 ** (attempt - 1)  # 1s, 2s, 4s
-            logger.warning(f"Network error on attempt {attempt}/{max_retries}: {e}. Retrying in {wait}s...")
-            time.sleep(wait)
-
-        except requests.exceptions.HTTPError as e:
-            status = e.response.status_code
-            last_exception = e
-
-            # Retry only on transient/server-side errors
-            if status in [429, 500, 502, 503, 504] and attempt < max_retries:
-                wait = 2 ** (attempt - 1)
-                logger.warning(f"HTTP {status} on attempt {attempt}/{max_retries}. Retrying in {wait}s...")
-                time.sleep(wait)
-            else:
-                logger.error(f"Non-retryable HTTP error {status}: {e.response.text}")
-                raise
-
-    # Should not reach here, but just in case
-    logger.error(f"All {max_retries} attempts failed")
-    raise last_exception
+    # Retries with backoff on network errors and 429/5xx happen in the shared session
+    with _in_flight:
+        response = get_session().post(
+            f"{DEEPSEEK_BASE_URL}/v1/chat/completions",
+            headers=headers,
+            json=payload,
+            timeout=300
+        )
+    try:
+        response.raise_for_status()
+    except requests.exceptions.HTTPError as e:
+        logger.error(f"DeepSeek HTTP error {e.response.status_code}: {e.response.text}")
+        raise
+    return response.json()
 
 def call_storyboard(title: str, slide_text: str, language: str):
     storyboard_system_prompt = load_prompt(PROMPT_DIR / "storyboard_system_prompt.txt")
@@ -266,10 +262,21 @@ class EducationalVideo(CScene):
 """
 
 
-def generate_animation(title: str, slide_text: str, language: str):
+def _emit(on_event, name: str, **data):
+    if on_event is None:
+        return
+    try:
+        on_event(name, **data)
+    except Exception as e:
+        logger.warning(f"Progress callback failed for {name}: {e}")
+
+
+def generate_animation(title: str, slide_text: str, language: str, on_event=None):
     """
     Generate a Manim animation for a single slide.
     Returns (manim_code, total_tokens, total_time) or None on failure.
+    on_event, if given, is called as on_event(name, **data) after each stage:
+    "storyboard-done", "code-done" and "review-attempt".
     """
 
     start_time = time.time()
@@ -284,12 +291,14 @@ def generate_animation(title: str, slide_text: str, language: str):
     if storyboard is None:
         logger.error("Failed to generate storyboard")
         return None
+    _emit(on_event, "storyboard-done", tokens=storyboard_tokens or 0)
 
     # Step 2: Generate animation code
     manim_code, manim_tokens = call_animation(storyboard, language, title)
     if manim_code is None:
         logger.error("Failed to generate Manim code")
         return None
+    _emit(on_event, "code-done", tokens=manim_tokens or 0)
 
     # Step 3: Review + validate loop (up to 3 attempts)
     total_review_tokens = 0
@@ -305,6 +314,7 @@ def generate_animation(title: str, slide_text: str, language: str):
 
         final_code = reviewed_code
         is_valid = validate_code(final_code)
+        _emit(on_event, "review-attempt", attempt=attempt + 1, valid=is_valid)
 
         if is_valid:
             logger.info(f"Code validated successfully on attempt {attempt + 1}")
@@ -320,6 +330,88 @@ def generate_animation(title: str, slide_text: str, language: str):
     logger.info(f"Animation generated — total tokens: {total_tokens}, time: {end_time - start_time:.2f}s")
     return (final_code, total_tokens, end_time - start_time)
 
+def iter_generate_animations(slides: list[dict], language: str, cache=None, on_event=None):
+    """
+    Run generate_animation for many slides concurrently.
+    Each slide dict needs "title" and "slide_text". Yields (index, result) in
+    completion order, where result is what generate_animation returns.
+    The stages of one slide stay sequential; DEEPSEEK_MAX_IN_FLIGHT bounds the
+    number of requests open against DeepSeek at any time.
+    With a cache (utils.manim.cache.CodeCache), slides seen before are yielded
+    first without any LLM call and newly validated code is stored.
+    on_event, if given, is called as on_event(index, name, **data) from the
+    worker threads as each slide moves through its stages.
+    """
+    def slide_events(idx):
+        if on_event is None:
+            return None
+        return lambda name, **data: on_event(idx, name, **data)
+
+    if not slides:
+        return
+
+    keys = {}
+    pending = []
+    for idx, slide in enumerate(slides):
+        if cache is None:
+            pending.append(idx)
+            continue
+        keys[idx] = cache.key_for(slide["title"], slide["slide_text"], language)
+        try:
+            cached_code = cache.get(keys[idx])
+        except Exception as e:
+            logger.warning(f"Code cache lookup failed: {e}")
+            cached_code = None
+        if cached_code:
+            logger.info(f"Code cache hit for slide {idx}: {slide['title']}")
+            _emit(slide_events(idx), "code-done", tokens=0, cached=True)
+            yield idx, (cached_code, 0, 0.0)
+        else:
+            pending.append(idx)
+
+    if not pending:
+        return
+
+    max_workers = min(len(pending), DEEPSEEK_MAX_IN_FLIGHT)
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="animation") as executor:
+        futures = {
+            executor.submit(generate_animation, slides[idx]["title"], slides[idx]["slide_text"], language, slide_events(idx)): idx
+            for idx in pending
+        }
+        try:
+            for future in as_completed(futures):
+                idx = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logger.error(f"Animation generation failed for slide {idx}: {e}")
+                    result = None
+                if cache is not None and result:
+                    _store_validated(cache, keys[idx], result[0], slides[idx]["title"], language)
+                yield idx, result
+        finally:
+            # Caller stopped early: drop slides that have not started yet
+            for future in futures:
+                future.cancel()
+
+
+def _store_validated(cache, key: str, code: str, title: str, language: str):
+    # Only cache code that passed review/validation, never the fallback scene
+    if not code or code == FALLBACK_CODE or not validate_code(code):
+        return
+    try:
+        cache.put(key, code, title=title, language=language, model=DEEPSEEK_MODEL)
+    except Exception as e:
+        logger.warning(f"Code cache store failed: {e}")
+
+
+def generate_animations(slides: list[dict], language: str, cache=None) -> list:
+    """Batch version of generate_animation; results are returned in slide order."""
+    results = [None] * len(slides)
+    for idx, result in iter_generate_animations(slides, language, cache=cache):
+        results[idx] = result
+    return results
+
 def fix_json_escapes(content: str) -> str:
     """Fix invalid escape sequences in LLM-generated JSON."""
     def replace_invalid_escape(match):
@@ -0,0 +1,117 @@
+import hmac
+import os
+import time
+
+from flask import Response, current_app, g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, REGISTRY, generate_latest, multiprocess,
+)
+from pymongo import monitoring
+
+# Prometheus metrics for every HTTP route and every MongoDB command, served at /metrics.
+# Under gunicorn each worker has its own counters; set PROMETHEUS_MULTIPROC_DIR
+# (see gunicorn.conf.py) so /metrics reports the sum over all workers.
+
+REQUEST_COUNT = Counter(
+    "http_requests_total", "HTTP requests by route and status",
+    ["method", "route", "status"]
+)
+REQUEST_EXCEPTIONS = Counter(
+    "http_request_exceptions_total", "Requests that raised an unhandled exception",
+    ["method", "route"]
+)
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Time to produce the response (streamed bodies excluded)",
+    ["method", "route"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+)
+RESPONSE_SIZE = Histogram(
+    "http_response_size_bytes", "Response body size (streamed bodies excluded)",
+    ["method", "route"],
+    buckets=(100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+)
+MONGO_DURATION = Histogram(
+    "mongodb_command_duration_seconds", "MongoDB command round trip time",
+    ["command", "collection"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+)
+MONGO_FAILURES = Counter(
+    "mongodb_command_failures_total", "MongoDB commands that returned an error",
+    ["command", "collection"]
+)
+
+
+def route_label() -> str:
+    # The URL rule, not the path, so /db/material/<material_id> is one series
+    return request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+
+
+def start_timer():
+    g.metrics_start = time.perf_counter()
+
+
+def record_response(response):
+    start = g.pop("metrics_start", None)
+    if start is None:
+        return response
+    method, route = request.method, route_label()
+    REQUEST_COUNT.labels(method, route, str(response.status_code)).inc()
+    if not response.is_streamed:
+        REQUEST_DURATION.labels(method, route).observe(time.perf_counter() - start)
+        size = response.calculate_content_length()
+        if size is not None:
+            RESPONSE_SIZE.labels(method, route).observe(size)
+    return response
+
+
+def record_exception(exc):
+    if exc is not None:
+        REQUEST_EXCEPTIONS.labels(request.method, route_label()).inc()
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Times every MongoDB command by command name and collection."""
+
+    def __init__(self):
+        # (connection, request_id) -> collection, from the started event
+        self.collections = {}
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            # getMore carries the cursor id there and the collection separately
+            collection = event.command.get("collection", "")
+        self.collections[(event.connection_id, event.request_id)] = collection
+
+    def finished(self, event):
+        collection = self.collections.pop((event.connection_id, event.request_id), "")
+        MONGO_DURATION.labels(event.command_name, collection).observe(event.duration_micros / 1_000_000)
+        return collection
+
+    def succeeded(self, event):
+        self.finished(event)
+
+    def failed(self, event):
+        collection = self.finished(event)
+        MONGO_FAILURES.labels(event.command_name, collection).inc()
+
+
+def metrics_view():
+    token = current_app.config.get("METRICS_TOKEN")
+    if token and not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}"):
+        return Response("Unauthorized\n", status=401, mimetype="text/plain")
+
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
+
+
+def init_metrics(app):
+    app.before_request(start_timer)
+    app.after_request(record_response)
+    app.teardown_request(record_exception)
+    app.add_url_rule("/metrics", "metrics", metrics_view, methods=["GET"])
+    print("[METRICS] Request and MongoDB metrics exposed at /metrics")
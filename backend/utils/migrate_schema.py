@@ -0,0 +1,129 @@
+import sys
+from datetime import datetime
+
+from pymongo import UpdateOne
+
+from utils.data_access import canonical_id
+
+# One-time migration to the canonical document schema the /db routes query:
+#   - materials keep topic/subtopic/form/language under attribute.* only
+#   - id fields that hold a 24-hex string become ObjectIds
+#     (ids that aren't ObjectIds, e.g. AI-generated material ids, stay strings)
+# Idempotent; run from the backend folder:
+#     python -m utils.migrate_schema [--dry-run]
+
+MIGRATION_ID = "canonical_schema_v1"
+BATCH_SIZE = 500
+
+ATTRIBUTE_FIELDS = ("topic", "subtopic", "form", "language")
+ID_FIELDS = {
+    "materials": ("subject_id", "uploaded_by", "created_by"),
+    "questions": ("material_id", "created_by"),
+    "student_answers": ("student_id", "material_id"),
+}
+
+def id_updates(doc: dict, fields) -> dict:
+    updates = {}
+    for field in fields:
+        value = doc.get(field)
+        converted = canonical_id(value)
+        if converted is not value:
+            updates[field] = converted
+    return updates
+
+
+def material_update(doc: dict) -> dict | None:
+    attr = doc.get("attribute")
+    set_fields = id_updates(doc, ID_FIELDS["materials"])
+    unset_fields = {}
+    moved = {}
+    for field in ATTRIBUTE_FIELDS:
+        if field in doc:
+            # attribute.* wins, as it did when the API read both formats
+            if not isinstance(attr, dict) or not attr.get(field):
+                moved[field] = doc[field]
+            unset_fields[field] = ""
+    if isinstance(attr, dict):
+        set_fields.update({f"attribute.{field}": value for field, value in moved.items()})
+    elif moved:
+        set_fields["attribute"] = moved
+    update = {}
+    if set_fields:
+        update["$set"] = set_fields
+    if unset_fields:
+        update["$unset"] = unset_fields
+    return update or None
+
+
+# Only 24-hex strings become ObjectIds; other string ids are already canonical
+HEX_ID_PATTERN = "^[0-9a-fA-F]{24}$"
+
+
+def needs_migration_filter(collection: str) -> dict:
+    clauses = [{field: {"$regex": HEX_ID_PATTERN}} for field in ID_FIELDS[collection]]
+    if collection == "materials":
+        clauses += [{field: {"$exists": True}} for field in ATTRIBUTE_FIELDS]
+    return {"$or": clauses}
+
+
+def migrate_collection(db, collection: str, dry_run: bool = False) -> int:
+    ops = []
+    changed = 0
+    for doc in db[collection].find(needs_migration_filter(collection)):
+        if collection == "materials":
+            update = material_update(doc)
+        else:
+            ids = id_updates(doc, ID_FIELDS[collection])
+            update = {"$set": ids} if ids else None
+        if not update:
+            continue
+        changed += 1
+        if dry_run:
+            continue
+        ops.append(UpdateOne({"_id": doc["_id"]}, update))
+        if len(ops) >= BATCH_SIZE:
+            db[collection].bulk_write(ops, ordered=False)
+            ops = []
+    if ops:
+        db[collection].bulk_write(ops, ordered=False)
+    return changed
+
+
+def is_migrated(db) -> bool:
+    return db.schema_migrations.find_one({"_id": MIGRATION_ID}, {"_id": 1}) is not None
+
+
+def has_legacy_documents(db) -> bool:
+    """True if any document still has a legacy shape (False for a new, empty database)."""
+    return any(
+        db[collection].find_one(needs_migration_filter(collection), {"_id": 1}) is not None
+        for collection in ID_FIELDS
+    )
+
+
+def migrate(db, dry_run: bool = False) -> dict:
+    """Rewrite documents to the canonical schema. Returns changed-document counts per collection."""
+    counts = {collection: migrate_collection(db, collection, dry_run) for collection in ID_FIELDS}
+    if not dry_run:
+        # Summaries are keyed by student_id, which may just have changed type
+        from utils import student_stats
+        student_stats.init_db(db)
+        student_stats.rebuild_student_stats()
+        db.schema_migrations.update_one(
+            {"_id": MIGRATION_ID},
+            {"$set": {"applied_at": datetime.utcnow(), "counts": counts}},
+            upsert=True
+        )
+    return counts
+
+
+if __name__ == "__main__":
+    from pymongo import MongoClient
+    from config import Config
+
+    dry_run = "--dry-run" in sys.argv[1:]
+    client = MongoClient(Config.MONGO_URI)
+    counts = migrate(client.get_default_database(), dry_run=dry_run)
+    client.close()
+    for collection, changed in counts.items():
+        print(f"[MIGRATE] {collection}: {changed} document(s) {'to change' if dry_run else 'changed'}")
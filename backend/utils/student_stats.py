@@ -0,0 +1,110 @@
+from datetime import datetime
+
+# Per-student analytics summary kept in the student_stats collection.
+# Submissions update it incrementally; soft-deleting a material rebuilds
+# the summaries of the students who attempted it. The analytics dashboard
+# reads from here instead of aggregating all of student_answers.
+
+db = None
+
+
+def init_db(db_instance):
+    global db
+    db = db_instance
+    if db is None:
+        return
+    # First start with this collection: build it from existing submissions
+    if db.student_stats.estimated_document_count() == 0 and db.student_answers.find_one({"status": "submitted"}, {"_id": 1}):
+        print("[STUDENT_STATS] Building student_stats from existing submissions")
+        rebuild_student_stats()
+
+
+def is_score(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def record_submission(submission: dict):
+    """Fold one newly inserted submission into its student's summary."""
+    if submission.get("status") != "submitted":
+        return
+
+    # Like the dashboard aggregation, ignore submissions for missing or deleted materials
+    material = db.materials.find_one(
+        {"_id": submission.get("material_id"), "is_deleted": {"$ne": True}},
+        {"_id": 1}
+    )
+    if not material:
+        return
+
+    score = submission.get("total_score")
+    inc = {"total_submissions": 1}
+    if is_score(score):
+        inc["score_sum"] = score
+        inc["score_count"] = 1
+
+    db.student_stats.update_one(
+        {"_id": submission.get("student_id")},
+        {
+            "$inc": inc,
+            "$max": {"last_activity": submission.get("submission_time")},
+            "$addToSet": {"materials_attempted": material["_id"]},
+            "$set": {"updated_at": datetime.utcnow()},
+        },
+        upsert=True
+    )
+
+
+def material_deleted(material_id):
+    """Recompute the summaries of every student who attempted a now-deleted material."""
+    student_ids = db.student_stats.distinct("_id", {"materials_attempted": material_id})
+    if student_ids:
+        rebuild_student_stats(student_ids)
+
+
+def rebuild_student_stats(student_ids: list | None = None):
+    """Recompute summaries from student_answers, for the given students or everyone."""
+    match = {"status": "submitted"}
+    if student_ids is not None:
+        match["student_id"] = {"$in": student_ids}
+
+    pipeline = [
+        {"$match": match},
+        {
+            "$lookup": {
+                "from": "materials",
+                "localField": "material_id",
+                "foreignField": "_id",
+                "as": "material_info"
+            }
+        },
+        {
+            "$match": {
+                "material_info": {"$ne": []},
+                "material_info.0.is_deleted": {"$ne": True}
+            }
+        },
+        {
+            "$group": {
+                "_id": "$student_id",
+                "total_submissions": {"$sum": 1},
+                "score_sum": {"$sum": "$total_score"},
+                "score_count": {"$sum": {"$cond": [{"$isNumber": "$total_score"}, 1, 0]}},
+                "last_activity": {"$max": "$submission_time"},
+                "materials_attempted": {"$addToSet": "$material_id"}
+            }
+        }
+    ]
+
+    now = datetime.utcnow()
+    rebuilt = []
+    for stats in db.student_answers.aggregate(pipeline):
+        stats["updated_at"] = now
+        db.student_stats.replace_one({"_id": stats["_id"]}, stats, upsert=True)
+        rebuilt.append(stats["_id"])
+
+    # Students left without any valid submission drop out of the dashboard
+    stale = {"_id": {"$nin": rebuilt}}
+    if student_ids is not None:
+        stale["_id"]["$in"] = student_ids
+    db.student_stats.delete_many(stale)
+    return len(rebuilt)
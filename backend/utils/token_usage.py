@@ -1,6 +1,9 @@
 from pathlib import Path
+import math
 import sys
+import threading
 import time
+from datetime import datetime, timedelta
 from flask import g
 
 sys.path.insert(0, str(Path(__file__).parent))
@@ -9,8 +12,6 @@ from logger import setup_logging
 
 logger = setup_logging(current_file=Path(__file__).stem)
 
-_session_storage = {}
-
 def get_token_usage(result):
     """Parse and return token usage from API response."""
     usage = result.get("usage", {})
@@ -32,76 +33,231 @@ def get_session_id():
         logger.info(f"Generated new session ID: {g.token_session_id}")
     return g.token_session_id
 
+DEFAULT_SESSION_TTL_SECONDS = 6 * 3600
+
+
+class MongoSessionStore:
+    """
+    Sessions in the token_sessions collection, shared by every worker process.
+    Updates are single atomic operations; a TTL index on expires_at removes
+    sessions that were never ended.
+    """
+
+    def __init__(self, collection, ttl_seconds: int = DEFAULT_SESSION_TTL_SECONDS):
+        self.collection = collection
+        self.ttl = timedelta(seconds=ttl_seconds)
+
+    def start(self, session_id: str):
+        now = datetime.utcnow()
+        self.collection.replace_one(
+            {"_id": session_id},
+            {"total_token_usage": 0, "start_time": now, "operations": [], "expires_at": now + self.ttl},
+            upsert=True
+        )
+
+    def touch(self, session_id: str) -> bool:
+        """Extend a live session's expiry. Returns False if it does not exist."""
+        result = self.collection.update_one(
+            {"_id": session_id},
+            {"$set": {"expires_at": datetime.utcnow() + self.ttl}}
+        )
+        return result.matched_count > 0
+
+    def add(self, session_id: str, tokens, operation: dict) -> bool:
+        """Add tokens and an operation record. Returns True if the session had to be created."""
+        now = datetime.utcnow()
+        result = self.collection.update_one(
+            {"_id": session_id},
+            {
+                "$inc": {"total_token_usage": tokens},
+                "$push": {"operations": operation},
+                "$set": {"expires_at": now + self.ttl},
+                "$setOnInsert": {"start_time": now},
+            },
+            upsert=True
+        )
+        return result.upserted_id is not None
+
+    def get(self, session_id: str) -> dict | None:
+        return self.collection.find_one({"_id": session_id})
+
+    def pop(self, session_id: str) -> dict | None:
+        return self.collection.find_one_and_delete({"_id": session_id})
+
+
+class LocalSessionStore:
+    """
+    In-process stand-in with the same interface, used when MongoDB is not
+    available. Only correct for a single worker process.
+    """
+
+    def __init__(self, ttl_seconds: int = DEFAULT_SESSION_TTL_SECONDS, max_sessions: int = 1000):
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self.max_sessions = max_sessions
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def evict(self, now: datetime):
+        # Caller holds the lock
+        for session_id in [sid for sid, s in self.sessions.items() if s["expires_at"] <= now]:
+            del self.sessions[session_id]
+        while len(self.sessions) >= self.max_sessions:
+            oldest = min(self.sessions, key=lambda sid: self.sessions[sid]["expires_at"])
+            del self.sessions[oldest]
+
+    def start(self, session_id: str):
+        now = datetime.utcnow()
+        with self.lock:
+            self.sessions.pop(session_id, None)
+            self.evict(now)
+            self.sessions[session_id] = {
+                "_id": session_id, "total_token_usage": 0, "start_time": now,
+                "operations": [], "expires_at": now + self.ttl
+            }
+
+    def touch(self, session_id: str) -> bool:
+        now = datetime.utcnow()
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is None or session["expires_at"] <= now:
+                return False
+            session["expires_at"] = now + self.ttl
+            return True
+
+    def add(self, session_id: str, tokens, operation: dict) -> bool:
+        now = datetime.utcnow()
+        with self.lock:
+            session = self.sessions.get(session_id)
+            created = session is None or session["expires_at"] <= now
+            if created:
+                self.sessions.pop(session_id, None)
+                self.evict(now)
+                session = self.sessions[session_id] = {
+                    "_id": session_id, "total_token_usage": 0, "start_time": now, "operations": []
+                }
+            session["total_token_usage"] += tokens
+            session["operations"].append(operation)
+            session["expires_at"] = now + self.ttl
+            return created
+
+    def get(self, session_id: str) -> dict | None:
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is None or session["expires_at"] <= datetime.utcnow():
+                return None
+            return {**session, "operations": list(session["operations"])}
+
+    def pop(self, session_id: str) -> dict | None:
+        with self.lock:
+            session = self.sessions.pop(session_id, None)
+        if session is None or session["expires_at"] <= datetime.utcnow():
+            return None
+        return session
+
+
+# Replaced by init_db(); the local store keeps tracking working before that (e.g. in scripts)
+session_store = LocalSessionStore()
+# One record per LLM operation (llm_operations collection), read by /admin/metrics/llm
+operations_collection = None
+
+# Endpoint labels the metrics single out
+MATERIAL_ENDPOINT = "/material/create"
+SLIDE_VIDEO_ENDPOINT = "/api/generate-video/generate"
+# llm_operations has a TTL index of the same length (utils/indexes.py)
+MAX_METRICS_DAYS = 90
+
+
+def init_db(db_instance, ttl_seconds: int = DEFAULT_SESSION_TTL_SECONDS):
+    global session_store, operations_collection
+    if db_instance is not None:
+        session_store = MongoSessionStore(db_instance.token_sessions, ttl_seconds)
+        operations_collection = db_instance.llm_operations
+    else:
+        print("[TOKEN_TRACKER] No database, token sessions are kept in this process only")
+        session_store = LocalSessionStore(ttl_seconds)
+
+
 class TokenUsageTracker:
     def __init__(self):
         pass
 
-    def start_session(self, session_id: str = None):
+    def start_session(self, session_id: str = None, user_id=None, material_id=None):
         """Start a NEW multi-endpoint session with a unique ID."""
         if session_id is None:
             session_id = get_session_id()
 
-        session_state = {
-            "session_id": session_id,
-            "total_token_usage": 0,
-            "start_time": time.time(),
-            "operations": [],
-            "endpoints": []
-        }
-        _session_storage[session_id] = session_state
+        session_store.start(session_id)
         g.token_session_id = session_id
+        # Labels copied onto every operation record of this context
+        g.token_labels = {"user_id": user_id, "material_id": material_id}
         logger.info(f"[SESSION {session_id}] New session started")
         return session_id
 
-    def start_session_tracking(self, session_id: str = None):
+    def start_session_tracking(self, session_id: str = None, user_id=None, material_id=None):
         """Continue or start a session for a single endpoint call."""
         if session_id is None:
             session_id = get_session_id()
 
-        # If session_id provided, use the server-side storage (multi-endpoint)
-        if session_id in _session_storage:
+        # If the session exists in the shared store (multi-endpoint), keep adding to it
+        if session_store.touch(session_id):
             g.token_session_id = session_id
+            g.token_labels = {"user_id": user_id, "material_id": material_id}
             logger.info(f"[SESSION {session_id}] Continuing existing session")
             return
         
         # Otherwise create new session
-        self.start_session(session_id)
+        self.start_session(session_id, user_id=user_id, material_id=material_id)
 
     def start_tracking(self):
         """Initialize a NEW context-local tracking (single endpoint)."""
         self.start_session()
 
-    def add_usage(self, token_usage, context: str = "", endpoint: str = ""):
+    def add_usage(self, token_usage, context: str = "", endpoint: str = "",
+                  latency_ms: float = None, model: str = None):
+        """Add tokens to the current session and record the operation for the LLM metrics."""
         session_id = get_session_id()
 
-        if session_id not in _session_storage:
-            logger.warning(f"[SESSION {session_id}] Session not found, creating new one")
-            self.start_session(session_id)
-
-        logger.info(f"[SESSION {session_id}] Token usage added: {token_usage} ({context})")
-
-        tracker_state = _session_storage[session_id]
-        tracker_state["total_token_usage"] += token_usage
-        tracker_state['operations'].append({
+        operation = {
             'context': context,
             'tokens': token_usage,
             'timestamp': time.asctime(time.localtime(time.time())),
             'endpoint': endpoint
-        })
-        logger.info(f"[SESSION {session_id}] Updated tracker state: {tracker_state['operations'][-1]}")
+        }
+        if session_store.add(session_id, token_usage, operation):
+            logger.warning(f"[SESSION {session_id}] Session not found, created a new one")
+
+        logger.info(f"[SESSION {session_id}] Token usage added: {token_usage} ({context})")
+        logger.info(f"[SESSION {session_id}] Updated tracker state: {operation}")
+
+        if operations_collection is not None:
+            labels = g.get("token_labels") or {}
+            try:
+                operations_collection.insert_one({
+                    "session_id": session_id,
+                    "context": context,
+                    "endpoint": endpoint,
+                    "model": model,
+                    "tokens": token_usage,
+                    "latency_ms": latency_ms,
+                    "user_id": labels.get("user_id"),
+                    "material_id": labels.get("material_id"),
+                    "created_at": datetime.utcnow(),
+                })
+            except Exception as e:
+                logger.warning(f"[SESSION {session_id}] Could not record operation: {e}")
 
     def end_tracking(self, session_id: str = None):
         if session_id is None:
             session_id = get_session_id()
 
-        if session_id not in _session_storage:
+        # Removing the session and reading it is one operation, so only one caller reports it
+        tracker_state = session_store.pop(session_id)
+        if tracker_state is None:
             logger.warning(f"[SESSION {session_id}] Session not found")
             return
         
-        tracker_state = _session_storage[session_id]
-        end_time = time.time()
         total_tokens = tracker_state['total_token_usage']
-        elapsed_time = end_time - tracker_state['start_time']
+        elapsed_time = (datetime.utcnow() - tracker_state['start_time']).total_seconds()
         
         logger.info("=" * 60)
         logger.info("TOKEN USAGE SUMMARY")
@@ -114,19 +270,113 @@ class TokenUsageTracker:
         logger.info(f"TOTAL: {total_tokens} tokens")
         logger.info(f"TIME: {elapsed_time:.2f}s")
         logger.info("=" * 60)
-        
-        # Clean up session storage
-        if session_id in _session_storage:
-            del _session_storage[session_id]
     
     def get_current_usage(self, session_id: str = None):
         """Get current accumulated token usage without ending session."""
         if session_id is None:
             session_id = get_session_id()
         
-        if session_id not in _session_storage:
+        tracker_state = session_store.get(session_id)
+        if tracker_state is None:
             return 0
         
-        return _session_storage[session_id]['total_token_usage']
+        return tracker_state['total_token_usage']
+
+token_tracker = TokenUsageTracker()
+
+
+def percentile(values: list, pct: float):
+    """Nearest-rank percentile; None for no values."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return round(ordered[rank - 1], 1)
+
+
+# Latencies are counted in log-scale buckets (40 per decade, ~6% wide) by
+# MongoDB, so the metrics never pull every latency of the window into memory
+LATENCY_BUCKETS_PER_DECADE = 40
+
+
+def histogram_percentile(histogram: dict, pct: float):
+    """Nearest-rank percentile from {bucket: count}; the bucket's geometric midpoint, None if empty."""
+    total = sum(histogram.values())
+    if not total:
+        return None
+    rank = max(1, math.ceil(pct / 100 * total))
+    seen = 0
+    for bucket in sorted(histogram):
+        seen += histogram[bucket]
+        if seen >= rank:
+            return round(10 ** ((bucket + 0.5) / LATENCY_BUCKETS_PER_DECADE), 1)
+
+
+def usage_summary(group: dict, histogram: dict) -> dict:
+    return {
+        "calls": group["calls"],
+        "total_tokens": group["total_tokens"],
+        "avg_tokens": round(group["total_tokens"] / group["calls"], 1) if group["calls"] else 0,
+        "p50_latency_ms": histogram_percentile(histogram, 50),
+        "p95_latency_ms": histogram_percentile(histogram, 95),
+    }
+
+
+def llm_metrics(days: int = 7) -> dict:
+    """Token and latency aggregates over the operations of the last `days` days."""
+    since = datetime.utcnow() - timedelta(days=days)
+    match = {"$match": {"created_at": {"$gte": since}}}
+
+    def grouped(key: str) -> dict:
+        totals = operations_collection.aggregate([
+            match,
+            {"$group": {"_id": key, "calls": {"$sum": 1}, "total_tokens": {"$sum": "$tokens"}}},
+        ])
+        histograms = {}
+        for bucket in operations_collection.aggregate([
+            match,
+            {"$match": {"latency_ms": {"$gt": 0}}},
+            {"$group": {
+                "_id": {
+                    "key": key,
+                    "bucket": {"$floor": {"$multiply": [{"$log10": "$latency_ms"}, LATENCY_BUCKETS_PER_DECADE]}},
+                },
+                "count": {"$sum": 1},
+            }},
+        ]):
+            group_histogram = histograms.setdefault(bucket["_id"].get("key"), {})
+            group_histogram[int(bucket["_id"]["bucket"])] = bucket["count"]
+        return {
+            str(group["_id"]) if group["_id"] else "unknown": usage_summary(group, histograms.get(group["_id"], {}))
+            for group in totals
+        }
+
+    by_endpoint = grouped("$endpoint")
+    per_material = [
+        group["tokens"] for group in operations_collection.aggregate([
+            match,
+            {"$match": {"endpoint": MATERIAL_ENDPOINT, "material_id": {"$ne": None}}},
+            {"$group": {"_id": "$material_id", "tokens": {"$sum": "$tokens"}}},
+        ])
+    ]
+    slide_videos = by_endpoint.get(SLIDE_VIDEO_ENDPOINT)
 
-token_tracker = TokenUsageTracker()
\ No newline at end of file
+    return {
+        "window_days": days,
+        "since": since.isoformat(),
+        "by_endpoint": by_endpoint,
+        "by_user": grouped("$user_id"),
+        "by_model": grouped("$model"),
+        "tokens_per_material": {
+            "materials": len(per_material),
+            "avg": round(sum(per_material) / len(per_material), 1) if per_material else 0,
+            "p95": percentile(per_material, 95),
+        },
+        # One operation per generated slide (cache hits make no LLM call and are not recorded)
+        "tokens_per_slide_video": {
+            "slides": slide_videos["calls"] if slide_videos else 0,
+            "avg": slide_videos["avg_tokens"] if slide_videos else 0,
+            "p50_latency_ms": slide_videos["p50_latency_ms"] if slide_videos else None,
+            "p95_latency_ms": slide_videos["p95_latency_ms"] if slide_videos else None,
+        },
+    }
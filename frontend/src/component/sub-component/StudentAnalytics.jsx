@@ -2,6 +2,11 @@ import React, { useState, useEffect } from 'react';
 import { useTranslation } from 'react-i18next';
 import { apiRequest } from '../../services/api'; 
 
+const REPORT_POLL_INTERVAL_MS = 3000;
+// Polls in a row without any student finishing before giving up (20 minutes);
+// the server reports a job whose process died as failed well before that
+const REPORT_POLL_MAX_ATTEMPTS = 400;
+
 // ── Helpers ──────────────────────────────────────────────
 
 const renderMarkdown = (markdown) => {
@@ -194,10 +199,30 @@ const StudentAnalytics = (props) => {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
             });
-            setGenerateAllResult(response);
+
+            // Reports are generated by a background job; poll until it finishes
+            let job = response;
+            let attempts = 0;
+            while (job && (job.status === 'queued' || job.status === 'running')) {
+                if (++attempts > REPORT_POLL_MAX_ATTEMPTS) {
+                    throw new Error('Report job timed out', { cause: 'timeout' });
+                }
+                await new Promise(resolve => setTimeout(resolve, REPORT_POLL_INTERVAL_MS));
+                const processed = job.processed;
+                job = await apiRequest(`/api/analytics/report/jobs/${response.job_id}`);
+                if (job?.processed !== processed) attempts = 0;
+            }
+            if (job?.status === 'failed') {
+                throw new Error(job.error || 'Report job failed');
+            }
+            setGenerateAllResult(job);
             setStoredReports({});
         } catch (err) {
-            setGenerateAllResult({ error: err.message || 'Failed to generate all reports' });
+            setGenerateAllResult({
+                error: err?.cause === 'timeout'
+                    ? t('reportJobTimeout')
+                    : err.message || 'Failed to generate all reports'
+            });
         } finally {
             setGeneratingAll(false);
         }
@@ -1,12 +1,58 @@
 import { useState, useEffect } from 'react';
 import '../../../styles.css';
 import '../../../dashboard.css';
-import { apiRequest } from '../../../services/api';
+import { apiRequest, API_BASE_URL } from '../../../services/api';
 import ViewMaterial from './ViewMaterial';
 import ViewQuestion from './ViewQuestion';
 import { useTranslation } from 'react-i18next';
 import { getLangText } from '../../../utils/langText';
 
+// Background generation is polled; give up after a deadline instead of waiting forever.
+// The backend reports generations whose worker died as failed well before that.
+const MATERIAL_POLL_INTERVAL_MS = 3000;
+const MATERIAL_POLL_MAX_ATTEMPTS = 300;  // 15 minutes
+const VIDEO_POLL_INTERVAL_MS = 5000;
+const VIDEO_POLL_MAX_ATTEMPTS = 720;     // 60 minutes
+
+// Follows a video job's progress stream, calling onVideo for each slide video as
+// soon as it is ready. Resolves with the finished job ({status, videos, error}),
+// or with null if the stream broke off (the caller then polls the job instead).
+function watchVideoJob(jobId, onVideo) {
+    return new Promise((resolve, reject) => {
+        if (typeof EventSource === 'undefined') {
+            resolve(null);
+            return;
+        }
+        const source = new EventSource(`${API_BASE_URL}/api/generate-video/jobs/${jobId}/events`);
+        const finish = (settle, value) => {
+            clearTimeout(deadline);
+            source.close();
+            settle(value);
+        };
+        const deadline = setTimeout(
+            () => finish(reject, new Error('Video generation timed out', { cause: 'timeout' })),
+            VIDEO_POLL_INTERVAL_MS * VIDEO_POLL_MAX_ATTEMPTS
+        );
+
+        source.onmessage = (message) => {
+            if (message.data === '[DONE]') {
+                finish(resolve, null);
+                return;
+            }
+            const event = JSON.parse(message.data);
+            if (event.event === 'url' && event.videoUrl) {
+                onVideo({ slide: event.slide, videoUrl: event.videoUrl });
+            } else if (event.event === 'job-completed') {
+                finish(resolve, { status: 'completed', videos: event.videos || [] });
+            } else if (event.event === 'job-failed') {
+                finish(resolve, { status: 'failed', error: event.error });
+            }
+        };
+        // Don't let EventSource reconnect on its own; fall back to polling
+        source.onerror = () => finish(resolve, null);
+    });
+}
+
 function GenerateMaterial({subject, onClose, userInfo, userRole}) {
     const { t, i18n } = useTranslation();
     const lang = i18n.language === 'zh-HK' ? 'zh' : 'en';
@@ -152,7 +198,21 @@ function GenerateMaterial({subject, onClose, userInfo, userRole}) {
                 body: formData
             });
 
+            // Slides are generated in the background; poll until the material is ready
             const data = response || {};
+            let status = data.data;
+            let attempts = 0;
+            while (status && status.status === 'generating') {
+                if (++attempts > MATERIAL_POLL_MAX_ATTEMPTS) {
+                    throw new Error('Material generation timed out', { cause: 'timeout' });
+                }
+                await new Promise(resolve => setTimeout(resolve, MATERIAL_POLL_INTERVAL_MS));
+                status = await apiRequest(`/api/llm/material/${data.data.sid}/status`);
+            }
+            if (status?.status === 'failed') {
+                throw new Error(status.error || 'Material generation failed');
+            }
+            data.data = { ...data.data, status: 'done', slides: status?.slides };
             console.log('[DEBUG] Full LLM response:', JSON.stringify(data));
             console.log('[DEBUG] LLM create response keys:', Object.keys(data));
             console.log('[DEBUG] data.sid:', data.data.sid);
@@ -165,7 +225,7 @@ function GenerateMaterial({subject, onClose, userInfo, userRole}) {
             generateQuestions(materialSid, submittedValues);
         } catch (error) {
             console.log(`Error sending material generation parameters: ${error}`);
-            setError(getText('matGenerateFailed'));
+            setError(getText(error?.cause === 'timeout' ? 'matGenerateTimeout' : 'matGenerateFailed'));
             setIsGenerating(false);
         }
     };
@@ -190,12 +250,39 @@ function GenerateMaterial({subject, onClose, userInfo, userRole}) {
                 body: JSON.stringify({ material_id: materialId, quality: "medium" })
             });
 
-            const videos = response?.videos || [];
+            // Generation runs as a background job; show each video as soon as it is ready.
+            // A material has one active job; a repeated request returns that job's id
+            setGeneratedVideos([]);
+            const addVideo = (video) => setGeneratedVideos(prev => [
+                ...prev.filter(v => v.slide !== video.slide), video
+            ].sort((a, b) => a.slide - b.slide));
+
+            let job = response;
+            if (job?.status === 'queued' || job?.status === 'running') {
+                job = await watchVideoJob(response.job_id, addVideo) || job;
+            }
+            // Stream unavailable or cut off: poll until the job finishes
+            let attempts = 0;
+            while (job && (job.status === 'queued' || job.status === 'running')) {
+                if (++attempts > VIDEO_POLL_MAX_ATTEMPTS) {
+                    throw new Error('Video generation timed out', { cause: 'timeout' });
+                }
+                await new Promise(resolve => setTimeout(resolve, VIDEO_POLL_INTERVAL_MS));
+                job = await apiRequest(`/api/generate-video/jobs/${response.job_id}`);
+            }
+            if (job?.status === 'failed') {
+                throw new Error(job.error || 'Video generation job failed');
+            }
+
+            const videos = (job?.videos || []).filter(video => video.videoUrl);
             console.log("Videos generated:", videos);
             setGeneratedVideos(videos);
         } catch (error) {
             console.error("Video generation failed:", error);
             console.warn("Video generation failed but material and questions are ready.");
+            if (error?.cause === 'timeout') {
+                setError(getText('videoGenerateTimeout'));
+            }
         } finally {
             setIsGeneratingVideo(false);
             setShowView(true);
@@ -400,6 +487,16 @@ function GenerateMaterial({subject, onClose, userInfo, userRole}) {
                 <div className="loading-container">
                     {isGenerating && <p>{getText('generateLoadingMessage')}</p>}
                     {isGeneratingVideo && <p>🎬 {getText('generating')}</p>}
+                    {isGeneratingVideo && generatedVideos.length > 0 && (
+                        <ul style={{ listStyle: 'none', padding: 0 }}>
+                            {generatedVideos.map(video => (
+                                <li key={video.slide}>
+                                    <p>✅ {t('videoReadyForSlide', { slide: video.slide })}</p>
+                                    <video src={`${API_BASE_URL}/${video.videoUrl}`} controls width="320" />
+                                </li>
+                            ))}
+                        </ul>
+                    )}
                 </div>
             ) : !showView ? (
                 <div className="loading-container">
@@ -274,21 +274,36 @@ function ViewMaterial({ material, materialData, userInfo, userRole, onClose}) {
 			// Show material
 			console.log('Fetching material:', material);
 			setMaterialId(material.id);
-			let slidesData = material?.slides;
-			if (typeof slidesData === 'string') {
-				try {
-					slidesData = JSON.parse(slidesData);
-				} catch (e) {
-					slidesData = [];
+			const showSlides = (slidesData) => {
+				if (typeof slidesData === 'string') {
+					try {
+						slidesData = JSON.parse(slidesData);
+					} catch (e) {
+						slidesData = [];
+					}
 				}
+				const slidesArray = Array.isArray(slidesData) ? slidesData : slidesData?.slides || [];
+				const normalizedSlides = slidesArray.map(slide => ({
+						...slide,
+						slidetype: slide.slideType || slide.slidetype,
+					}));
+				setSlides(normalizedSlides);
+				setCurrentSlideIndex(0);
+			};
+			if (material.slides !== undefined) {
+				showSlides(material.slides);
+			} else {
+				// Material lists are fetched without slides
+				apiRequest(`/db/material/${material.id}`)
+				.then(data => {
+					if (!active) return;
+					showSlides(data?.material?.slides);
+				})
+				.catch(e => {
+					console.log('Failed to load material slides', e);
+					if (active) showSlides([]);
+				});
 			}
-			const slidesArray = Array.isArray(slidesData) ? slidesData : slidesData?.slides || [];
-			const normalizedSlides = slidesArray.map(slide => ({
-					...slide,
-					slidetype: slide.slideType || slide.slidetype,
-				}));
-			setSlides(normalizedSlides);
-			setCurrentSlideIndex(0);
 			// capture video_url
 			if (material?.video_url) { 
 				setVideoUrl(material.video_url); 
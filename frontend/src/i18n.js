@@ -30,6 +30,7 @@ const resources = {
       generateAllSuccess: 'Generated {{count}} reports successfully.',
       generateAllFailed: '{{count}} failed.',
       generateAllError: 'Error: {{message}}',
+      reportJobTimeout: 'Report generation is taking too long. Reports finished so far are saved; please try again later.',
 
       //Dashboard
       dashboardTitle: 'Dashboard',
@@ -133,6 +134,9 @@ const resources = {
       selectTopicWarning: 'Please select a topic.',
       selectLanguageWarning: 'Please select a language.',
       matGenerateFailed: 'Failed to generate material. Please try again.',
+      matGenerateTimeout: 'Material generation is taking too long. Please try again later.',
+      videoGenerateTimeout: 'Video generation is taking too long. The material and questions are ready; try generating the videos again later.',
+      videoReadyForSlide: 'Video for slide {{slide}} is ready',
       questionGenerateFailed: 'Failed to send question generation request.',
       subjectList: 'Subject:',
       formList: 'Form:',
@@ -184,6 +188,7 @@ const resources = {
       generateAllSuccess: '成功生成 {{count}} 份報告。',
       generateAllFailed: '{{count}} 份失敗。',
       generateAllError: '錯誤：{{message}}',
+      reportJobTimeout: '生成報告時間過長。已完成的報告已儲存，請稍後再試。',
 
       //Dashboard
       dashboardTitle: '控制台',
@@ -287,6 +292,9 @@ const resources = {
       selectTopicWarning: '請選擇課題',
       selectLanguageWarning: '請選擇語言',
       matGenerateFailed: '生成學習材料失敗。請重試。',
+      matGenerateTimeout: '生成學習材料時間過長，請稍後再試。',
+      videoGenerateTimeout: '生成影片時間過長。學習材料和問題已準備好，請稍後再嘗試生成影片。',
+      videoReadyForSlide: '第 {{slide}} 張投影片的影片已完成',
       questionGenerateFailed: '發送問題生成請求失敗。',
       subjectList: '科目:',
       formList: '年級:',
@@ -1,5 +1,5 @@
 // frontend/src/service/api.js
-const API_BASE_URL = 'http://localhost:5000';
+export const API_BASE_URL = 'http://localhost:5000';
 
 const getAuthToken = () => {
   return sessionStorage.getItem('access_token');
@@ -33,9 +33,10 @@ export const apiRequest = async (endpoint, options = {}) => {
 
 export const materialAPI = {
   getAll: async (subjectId = null) => {
+    // Lists skip slides; ViewMaterial fetches them from /db/material/<id>
     const url = subjectId 
-      ? `/db/material?subject_id=${subjectId}`
-      : `/db/material`;
+      ? `/db/material?subject_id=${subjectId}&view=summary`
+      : `/db/material?view=summary`;
     const data = await apiRequest(url);
     return data.materials || [];
   },